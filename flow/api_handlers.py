@@ -1,3 +1,4 @@
+import asyncio
 import shutil
 import os
 import re
@@ -6,60 +7,142 @@ import json
 import hashlib
 import urllib.parse
 from pathlib import Path
-from aiohttp import web
-from typing import Any
-from io import BytesIO
-from PIL import Image
+from aiohttp import web, hdrs
 
 from .constants import (
-    APP_CONFIGS, APP_VERSION, EXTENSION_NODE_MAP_PATH,
+    APP_VERSION, EXTENSION_NODE_MAP_PATH,
     CUSTOM_NODES_DIR, FLOWMSG, logger, FLOWS_PATH, WEBROOT, CORE_PATH,
-    SAFE_FOLDER_NAME_REGEX, ALLOWED_EXTENSIONS, CUSTOM_THEMES_DIR, FLOWS_CONFIG_FILE
+    SAFE_FOLDER_NAME_REGEX, ALLOWED_EXTENSIONS, CUSTOM_THEMES_DIR, FLOWS_CONFIG_FILE,
+    PREVIEW_ID_REGEX, MODEL_PREVIEW_MAX_UPLOAD_BYTES, FLOW_CONFIG_MAX_BYTES, FLOW_UPLOAD_MAX_PART_BYTES,
+    FLOW_THUMBNAIL_MAX_BYTES, FLOW_UPLOAD_MAX_TOTAL_BYTES, FLOW_BUNDLE_MAX_BYTES, FLOW_BUNDLE_MAX_EXTRACTED_BYTES
 )
+from .http_cache import (
+    IMMUTABLE_CACHE_CONTROL, REVALIDATE_CACHE_CONTROL, conditional_response, variant_response
+)
+from .preview_cache import preview_cache, response_cache
+from .preview_store import (
+    PREVIEWS_BLOBS_DIR, THUMBNAIL_FILENAME, ensure_data_folders, get_preview_id, get_preview_entry, get_blob_version, get_blob_folder,
+    load_preview_thumbnail, load_registry_index, invalidate_registry_cache, preview_registry,
+    pick_rendition_size, store_preview_blob, remove_preview_blobs, record_preview_access
+)
+from .preview_maintenance import get_last_report, run_preview_maintenance_async
+from .flow_catalog import flow_catalog
+from .flow_storage import FileCopy, encode_json, flow_lock, write_flow_files, copy_flow_files, delete_flow_folder
+from .flow_blobs import compact_flow, compact_flows
+from .flow_bundles import BUNDLE_FORMATS, BundleStream, InvalidBundle, extract_bundle, install_staged_flow, plan_import
+from .flow_artifacts import InvalidArtifact, load_flow_artifact, invalidate_flow_artifact
+from .downloader import get_sync_status
+from .asset_manifest import get_asset_manifest
+from .theme_registry import theme_registry
+from .image_worker import image_pool
+from .preview_atlas import ATLAS_MAX_ITEMS, atlas_max_items, build_atlas, register_atlas
+from .uploads import (
+    UPLOAD_CHUNK_SIZE, FlowUpload, InvalidUpload, UploadTooLarge, iter_part_chunks, read_flow_upload,
+    stream_to_temp_file
+)
+from .image_processing import MODEL_PREVIEW_THUMBNAIL_WIDTH, make_flow_thumbnail, rendition_formats, sniff_image_mime
 
-DATA_DIR = Path(__file__).parent / "data"
-PREVIEWS_REGISTRY_DIR = DATA_DIR / "model_previews_registry"
-PREVIEWS_IMAGES_DIR = DATA_DIR / "model_previews"
+NDJSON_CONTENT_TYPE = "application/x-ndjson"
+NDJSON_BATCH_SIZE = 64
+PREVIEWS_PAGE_SIZE = 200
+PREVIEWS_MAX_PAGE_SIZE = 1000
+ATLAS_CELL_SIZES = (64, 128, 256)
+APPS_MAX_FIELDS = 32
 
-def ensure_data_folders():
-    try:
-        DATA_DIR.mkdir(parents=True, exist_ok=True)
-        PREVIEWS_REGISTRY_DIR.mkdir(parents=True, exist_ok=True)
-        PREVIEWS_IMAGES_DIR.mkdir(parents=True, exist_ok=True)
-    except Exception as e:
-        logger.error(f"{FLOWMSG}: Could not create data dirs: {e}")
+IMAGE_MIME_REGEX = re.compile(r'^image/\w+$')
+SNIFFED_CONTENT_TYPE = "application/octet-stream"
+
+def get_source_extension(mime_type: str) -> str:
+    subtype = mime_type.split('/')[-1].lower()
+    return "jpg" if subtype == "jpeg" else subtype
 
-def pathToKey(model_path: str) -> str:
-    return model_path.replace('\\', '/')
+async def iter_bytes(data: bytes):
+    yield data
 
-def get_filename_only(model_path: str) -> str:
-    fwd = pathToKey(model_path)
-    return os.path.basename(fwd)
+async def save_model_preview(raw_path: str, mime_type: str, chunks) -> web.Response:
+    # Browsers leave File.type empty for some extensions; Pillow decides what those are.
+    sniff = mime_type in ("", SNIFFED_CONTENT_TYPE)
+    if not sniff and not IMAGE_MIME_REGEX.match(mime_type):
+        return web.Response(status=415, text=f"Unsupported image type '{mime_type}'")
 
-def get_preview_id(model_path: str) -> str:
-    filename = get_filename_only(model_path)
-    h = hashlib.sha1(filename.encode('utf-8')).hexdigest()
-    return h[:16]
+    pid = get_preview_id(raw_path)
+    hasher = hashlib.sha256()
+    try:
+        tmp_path = await stream_to_temp_file(chunks, PREVIEWS_BLOBS_DIR, MODEL_PREVIEW_MAX_UPLOAD_BYTES, hasher)
+    except UploadTooLarge as e:
+        return web.Response(status=413, text=str(e))
 
-def get_preview_paths(preview_id: str):
-    sub1 = preview_id[0]
-    sub2 = preview_id[:2]
-    registry_json = PREVIEWS_REGISTRY_DIR / sub1 / sub2 / f"{preview_id}.json"
-    image_folder = PREVIEWS_IMAGES_DIR / sub1 / sub2 / preview_id
-    return registry_json, image_folder
+    if sniff:
+        mime_type = await asyncio.get_running_loop().run_in_executor(None, sniff_image_mime, str(tmp_path))
+        if mime_type is None or not IMAGE_MIME_REGEX.match(mime_type):
+            tmp_path.unlink(missing_ok=True)
+            return web.Response(status=415, text="Unrecognized image data")
+
+    blob_hash = hasher.hexdigest()
+    try:
+        thumb_stat = await image_pool.run(store_preview_blob, tmp_path, blob_hash, get_source_extension(mime_type))
+    except Exception as e:
+        tmp_path.unlink(missing_ok=True)
+        logger.error(f"{FLOWMSG}: Error rendering model preview for '{raw_path}': {e}")
+        return web.Response(status=400, text="Invalid image data")
+
+    def assign() -> bool:
+        released = preview_registry.assign(pid, raw_path, mime_type, blob_hash, thumb_stat)
+        remove_preview_blobs([released])
+        # The upload is still on disk only if it matched an existing blob. Once assign() has
+        # retained that blob nothing can remove it, but a release just before may already have.
+        return tmp_path.exists() and not (get_blob_folder(blob_hash) / THUMBNAIL_FILENAME).exists()
+
+    loop = asyncio.get_running_loop()
+    try:
+        if await loop.run_in_executor(None, assign):
+            thumb_stat = await image_pool.run(store_preview_blob, tmp_path, blob_hash, get_source_extension(mime_type))
+            await loop.run_in_executor(None, preview_registry.assign, pid, raw_path, mime_type, blob_hash, thumb_stat)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+    invalidate_registry_cache()
+    return web.json_response({"status": "success", "previewId": pid, "version": get_blob_version(blob_hash)})
 
 async def set_model_preview_handler(request: web.Request) -> web.Response:
     try:
         ensure_data_folders()
-        data = await request.json()
+
+        if request.content_type.startswith("image/") or request.content_type == SNIFFED_CONTENT_TYPE:
+            rawPath = request.query.get("modelPath", None)
+            if not rawPath:
+                return web.Response(status=400, text="Missing 'modelPath'")
+            return await save_model_preview(rawPath, request.content_type, request.content.iter_chunked(UPLOAD_CHUNK_SIZE))
+
+        if request.content_type.startswith("multipart/"):
+            rawPath = request.query.get("modelPath", None)
+            reader = await request.multipart()
+            while True:
+                part = await reader.next()
+                if part is None:
+                    break
+                if part.name == "modelPath":
+                    rawPath = (await part.text()).strip()
+                elif part.name == "image":
+                    if not rawPath:
+                        return web.Response(status=400, text="Missing 'modelPath' before 'image' part")
+                    mime_type = part.headers.get(hdrs.CONTENT_TYPE, "").split(";")[0].strip()
+                    return await save_model_preview(rawPath, mime_type, iter_part_chunks(part))
+            return web.Response(status=400, text="Missing 'image' part")
+
+        if request.content_type != "application/json":
+            return web.Response(status=415, text=f"Unsupported content type '{request.content_type}'")
+
+        try:
+            data = await request.json()
+        except ValueError:
+            return web.Response(status=400, text="Invalid JSON body")
+        if not isinstance(data, dict):
+            return web.Response(status=400, text="Invalid JSON body")
         rawPath = data.get("modelPath") 
         base64_data = data.get("base64Data")
         if not rawPath or not base64_data:
             return web.Response(status=400, text="Missing 'modelPath' or 'base64Data'")
 
-        pid = get_preview_id(rawPath) 
-        registry_json, image_folder = get_preview_paths(pid)
-
         match = re.match(r"data:(image/\w+);base64,(.+)", base64_data)
         if not match:
             return web.Response(status=400, text="Invalid data URL format")
@@ -71,30 +154,7 @@ async def set_model_preview_handler(request: web.Request) -> web.Response:
         except:
             return web.Response(status=400, text="Error decoding base64 image")
 
-        registry_json.parent.mkdir(parents=True, exist_ok=True)
-        image_folder.mkdir(parents=True, exist_ok=True)
-
-        full_path = image_folder / "full.jpg"
-        with full_path.open("wb") as f:
-            f.write(raw_image)
-
-        thumb_path = image_folder / "thumbnail.jpg"
-        img = Image.open(BytesIO(raw_image))
-        w_percent = 128.0 / float(img.size[0])
-        h_new = int(float(img.size[1]) * w_percent)
-        img = img.convert("RGB").resize((128, h_new), Image.Resampling.LANCZOS)
-        img.save(thumb_path, format="JPEG")
-
-        reg_data = {
-            "modelPath": rawPath,
-            "previewId": pid,
-            "timestamp": int(os.path.getmtime(full_path)),
-            "mime_type": mime_type
-        }
-        with registry_json.open("w", encoding="utf-8") as jf:
-            json.dump(reg_data, jf, indent=2)
-
-        return web.json_response({"status": "success", "previewId": pid})
+        return await save_model_preview(rawPath, mime_type, iter_bytes(raw_image))
 
     except Exception as e:
         logger.error(f"{FLOWMSG}: Error in set_model_preview_handler: {e}")
@@ -108,87 +168,102 @@ async def clear_model_preview_handler(request: web.Request) -> web.Response:
             return web.Response(status=400, text="Missing 'modelPath'")
 
         pid = get_preview_id(rawPath)
-        registry_json, image_folder = get_preview_paths(pid)
 
-        if registry_json.exists():
-            registry_json.unlink()
-        if image_folder.exists() and image_folder.is_dir():
-            shutil.rmtree(image_folder)
+        def clear() -> None:
+            _, released = preview_registry.delete(pid)
+            remove_preview_blobs([released])
+
+        await asyncio.get_running_loop().run_in_executor(None, clear)
+        invalidate_registry_cache()
 
         return web.json_response({"status": "success", "previewId": pid})
     except Exception as e:
         logger.error(f"{FLOWMSG}: Error in clear_model_preview_handler: {e}")
         return web.Response(status=500, text=str(e))
 
-async def list_model_previews_handler(request: web.Request) -> web.Response:
+def wants_ndjson(request: web.Request) -> bool:
+    if request.query.get("stream") in ("1", "true"):
+        return True
+    return NDJSON_CONTENT_TYPE in request.headers.get("Accept", "")
+
+def iter_path_previews(raw_paths):
+    for rp in raw_paths:
+        if not isinstance(rp, str):
+            continue
+        rp = urllib.parse.unquote(rp).strip()
+        if not rp:
+            continue
+        entry = get_preview_entry(rp)
+        if entry:
+            yield rp, entry
+
+def iter_registry_previews(entries):
+    for entry in entries:
+        yield entry["modelPath"], {"previewId": entry["previewId"], "version": entry["version"]}
+
+async def stream_previews(request: web.Request, items, headers=None) -> web.StreamResponse:
+    response = web.StreamResponse(headers=headers)
+    response.content_type = NDJSON_CONTENT_TYPE
+    response.headers["Cache-Control"] = "no-cache"
+    response.enable_chunked_encoding()
+    await response.prepare(request)
+
+    lines = []
+    for mp, entry in items:
+        lines.append(json.dumps({"modelPath": mp, **entry}))
+        if len(lines) >= NDJSON_BATCH_SIZE:
+            await response.write(("\n".join(lines) + "\n").encode("utf-8"))
+            lines = []
+    if lines:
+        await response.write(("\n".join(lines) + "\n").encode("utf-8"))
+
+    await response.write_eof()
+    return response
+
+async def list_model_previews_handler(request: web.Request) -> web.StreamResponse:
     try:
         ensure_data_folders()
-        result_map = {}
+        raw_paths = None
 
         if request.method == 'POST':
             data = await request.json()
             raw_paths = data.get('paths', [])
             if not isinstance(raw_paths, list):
                 return web.Response(status=400, text="Invalid JSON: 'paths' must be an array")
+        else:
+            paths_param = request.rel_url.query.get('paths', None)
+            if paths_param:
+                raw_paths = paths_param.split(',')
 
-            for rp in raw_paths:
-                rp = urllib.parse.unquote(rp).strip()
-                if not rp:
-                    continue
-                pid = get_preview_id(rp)
-                _, image_folder = get_preview_paths(pid)
-                thumb = image_folder / "thumbnail.jpg"
-                if thumb.exists():
-                    with thumb.open("rb") as tf:
-                        b = tf.read()
-                    b64 = base64.b64encode(b).decode("utf-8")
-                    data_url = f"data:image/jpeg;base64,{b64}"
-                    result_map[rp] = data_url
-
-            return web.json_response(result_map)
-
-        paths_param = request.rel_url.query.get('paths', None)
-        if paths_param:
-            raw_split = paths_param.split(',')
-            for rp in raw_split:
-                rp = rp.strip()
-                if not rp:
-                    continue
-                rp = urllib.parse.unquote(rp)
-                pid = get_preview_id(rp)
-                _, image_folder = get_preview_paths(pid)
-                thumb = image_folder / "thumbnail.jpg"
-                if thumb.exists():
-                    with thumb.open("rb") as tf:
-                        b = tf.read()
-                    b64 = base64.b64encode(b).decode("utf-8")
-                    result_map[rp] = f"data:image/jpeg;base64,{b64}"
-            return web.json_response(result_map)
-
-        for root, dirs, files in os.walk(PREVIEWS_REGISTRY_DIR):
-            for filename in files:
-                if filename.endswith(".json"):
-                    regp = Path(root) / filename
-                    try:
-                        with regp.open("r", encoding="utf-8") as f:
-                            reg_data = json.load(f)
-                        mp = reg_data.get("modelPath")
-                        pid = reg_data.get("previewId")
-                        if not mp or not pid:
-                            continue
-
-                        _, folder = get_preview_paths(pid)
-                        thumb = folder / "thumbnail.jpg"
-                        if thumb.exists():
-                            with thumb.open("rb") as tf:
-                                b = tf.read()
-                            b64 = base64.b64encode(b).decode("utf-8")
-                            result_map[mp] = f"data:image/jpeg;base64,{b64}"
-                    except Exception as ex:
-                        logger.error(f"{FLOWMSG}: Error reading registry {regp}: {ex}")
-                        continue
-
-        return web.json_response(result_map)
+        if raw_paths is not None:
+            items = iter_path_previews(raw_paths)
+            if wants_ndjson(request):
+                return await stream_previews(request, items)
+            return web.json_response(dict(items))
+
+        if 'limit' in request.query or 'cursor' in request.query:
+            try:
+                limit = min(int(request.query.get('limit', PREVIEWS_PAGE_SIZE)), PREVIEWS_MAX_PAGE_SIZE)
+            except ValueError:
+                return web.Response(status=400, text="Invalid 'limit'")
+            if limit < 1:
+                return web.Response(status=400, text="Invalid 'limit'")
+
+            cursor = request.query.get('cursor') or None
+            entries = await asyncio.get_running_loop().run_in_executor(None, preview_registry.list_page, cursor, limit)
+            next_cursor = entries[-1]["previewId"] if len(entries) == limit else None
+            if wants_ndjson(request):
+                headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+                return await stream_previews(request, iter_registry_previews(entries), headers)
+            return web.json_response({
+                "items": dict(iter_registry_previews(entries)),
+                "nextCursor": next_cursor,
+            })
+
+        items = iter_registry_previews(load_registry_index().values())
+        if wants_ndjson(request):
+            return await stream_previews(request, items)
+        return web.json_response(dict(items))
 
     except Exception as e:
         logger.error(f"{FLOWMSG}: Error in list_model_previews_handler: {e}")
@@ -201,16 +276,9 @@ async def get_model_preview_handler(request: web.Request) -> web.Response:
         if not rawPath:
             return web.Response(status=400, text="Missing 'modelPath'")
 
-        pid = get_preview_id(rawPath)
-        _, image_folder = get_preview_paths(pid)
-
-        thumb = image_folder / "thumbnail.jpg"
-        if thumb.exists():
-            with thumb.open("rb") as tf:
-                b = tf.read()
-            b64 = base64.b64encode(b).decode("utf-8")
-            data_url = f"data:image/jpeg;base64,{b64}"
-            return web.json_response({rawPath: data_url})
+        entry = get_preview_entry(rawPath)
+        if entry:
+            return web.json_response({rawPath: entry})
         else:
             return web.Response(status=404, text="Preview not found")
 
@@ -218,12 +286,170 @@ async def get_model_preview_handler(request: web.Request) -> web.Response:
         logger.error(f"{FLOWMSG}: Error in get_model_preview_handler: {e}")
         return web.Response(status=500, text=str(e))
 
+def negotiate_preview_format(request: web.Request) -> str:
+    requested = request.query.get("format")
+    if requested in rendition_formats():
+        return requested
+    if "webp" in rendition_formats() and "image/webp" in request.headers.get("Accept", ""):
+        return "webp"
+    return "jpeg"
+
+async def model_preview_thumbnail_handler(request: web.Request) -> web.Response:
+    pid = request.match_info.get("previewId", "")
+    if not PREVIEW_ID_REGEX.match(pid):
+        return web.Response(status=400, text="Invalid 'previewId'")
+
+    try:
+        size = pick_rendition_size(int(request.query.get("size", MODEL_PREVIEW_THUMBNAIL_WIDTH)))
+    except ValueError:
+        return web.Response(status=400, text="Invalid 'size'")
+
+    try:
+        thumb = load_preview_thumbnail(pid, size, negotiate_preview_format(request))
+        if not thumb:
+            return web.Response(status=404, text="Preview not found")
+
+        record_preview_access(pid)
+        entry = load_registry_index().get(pid)
+        current = entry is not None and request.query.get("v") == entry["version"]
+        cache_control = IMMUTABLE_CACHE_CONTROL if current else REVALIDATE_CACHE_CONTROL
+        return conditional_response(request, thumb["data"], thumb["contentType"], thumb["etag"], thumb["mtime"],
+                                    cache_control, extra_headers={"Vary": "Accept"})
+
+    except Exception as e:
+        logger.error(f"{FLOWMSG}: Error in model_preview_thumbnail_handler: {e}")
+        return web.Response(status=500, text=str(e))
+
+async def model_previews_atlas_handler(request: web.Request) -> web.Response:
+    try:
+        ensure_data_folders()
+        data = await request.json()
+        raw_paths = data.get('paths', [])
+        if not isinstance(raw_paths, list):
+            return web.Response(status=400, text="Invalid JSON: 'paths' must be an array")
+        if len(raw_paths) > ATLAS_MAX_ITEMS:
+            return web.Response(status=400, text=f"Too many paths, at most {ATLAS_MAX_ITEMS} are allowed")
+        try:
+            cell = int(data.get('cell', MODEL_PREVIEW_THUMBNAIL_WIDTH))
+        except (TypeError, ValueError):
+            cell = 0
+        if cell not in ATLAS_CELL_SIZES:
+            return web.Response(status=400, text=f"Invalid 'cell', expected one of {list(ATLAS_CELL_SIZES)}")
+        if len(raw_paths) > atlas_max_items(cell):
+            return web.Response(status=400, text=f"Too many paths, at most {atlas_max_items(cell)} are allowed for cell {cell}")
+
+        path_pids = {rp: entry["previewId"] for rp, entry in iter_path_previews(raw_paths)}
+        if not path_pids:
+            return web.json_response({"atlasId": None, "items": {}})
+
+        loop = asyncio.get_running_loop()
+        atlas_id = await loop.run_in_executor(None, register_atlas, list(path_pids.values()), cell)
+        atlas = await build_atlas(atlas_id)
+        if not atlas:
+            return web.Response(status=500, text="Atlas could not be built")
+        items = {}
+        for rp, pid in path_pids.items():
+            box = atlas["boxes"].get(pid)
+            if box:
+                items[rp] = {"x": box[0], "y": box[1], "w": box[2], "h": box[3]}
+
+        return web.json_response({
+            "atlasId": atlas["atlasId"],
+            "version": atlas["version"],
+            "url": f"/flow/api/model-previews/atlas/{atlas['atlasId']}?v={atlas['version']}",
+            "width": atlas["width"],
+            "height": atlas["height"],
+            "cell": cell,
+            "items": items,
+        })
+
+    except Exception as e:
+        logger.error(f"{FLOWMSG}: Error in model_previews_atlas_handler: {e}")
+        return web.Response(status=500, text=str(e))
+
+async def model_previews_atlas_image_handler(request: web.Request) -> web.Response:
+    atlas_id = request.match_info.get("atlasId", "")
+    if not PREVIEW_ID_REGEX.match(atlas_id):
+        return web.Response(status=400, text="Invalid 'atlasId'")
+
+    try:
+        atlas = await build_atlas(atlas_id)
+        if not atlas:
+            return web.Response(status=404, text="Atlas not found")
+
+        cache_control = IMMUTABLE_CACHE_CONTROL if request.query.get("v") == atlas["version"] else REVALIDATE_CACHE_CONTROL
+        return conditional_response(request, atlas["data"], "image/jpeg", atlas["etag"], cache_control=cache_control)
+
+    except Exception as e:
+        logger.error(f"{FLOWMSG}: Error in model_previews_atlas_image_handler: {e}")
+        return web.Response(status=500, text=str(e))
+
+async def model_previews_maintenance_handler(request: web.Request) -> web.Response:
+    if request.method == "GET":
+        return web.json_response({"lastReport": get_last_report()})
+    try:
+        report = await run_preview_maintenance_async(is_truthy(request.query.get('orphans')))
+        return web.json_response(report)
+    except Exception as e:
+        logger.error(f"{FLOWMSG}: Error in model_previews_maintenance_handler: {e}")
+        return web.Response(status=500, text=str(e))
+
+async def flow_stats_handler(request: web.Request) -> web.Response:
+    return web.json_response({
+        "previewCache": preview_cache.stats(),
+        "responseCache": response_cache.stats(),
+        "imageWorkers": image_pool.stats(),
+    })
+
+async def sync_status_handler(request: web.Request) -> web.Response:
+    return web.json_response(get_sync_status(), headers={"Cache-Control": "no-store"})
+
+def parse_fields(raw: str):
+    fields = tuple(sorted({field.strip() for field in raw.split(",") if field.strip()}))
+    return fields or None
+
 async def apps_handler(request: web.Request) -> web.Response:
-    return web.json_response(APP_CONFIGS)
+    fields = parse_fields(request.query["fields"]) if "fields" in request.query else None
+    if fields is not None and len(fields) > APPS_MAX_FIELDS:
+        return web.Response(status=400, text=f"Too many fields, at most {APPS_MAX_FIELDS} are allowed")
+    encoded = flow_catalog.peek_encoded(fields)
+    if encoded is None:
+        loop = asyncio.get_running_loop()
+        encoded = await loop.run_in_executor(None, flow_catalog.encoded, fields)
+    return variant_response(request, encoded["variants"], "application/json", encoded["etag"])
+
+async def flow_artifact_handler(request: web.Request) -> web.Response:
+    flow_url = request.query.get('url', '')
+    if not SAFE_FOLDER_NAME_REGEX.match(flow_url):
+        return web.Response(status=400, text="Invalid 'url' parameter.")
+
+    if flow_url == 'linker':
+        flow_dir = WEBROOT / 'linker'
+    else:
+        entry = flow_catalog.get(flow_url)
+        if entry is None:
+            return web.Response(status=404, text=f"Flow with url '{flow_url}' does not exist")
+        flow_dir = entry['dir']
+
+    try:
+        loop = asyncio.get_running_loop()
+        artifact = await loop.run_in_executor(None, load_flow_artifact, flow_url, flow_dir)
+        if artifact is None:
+            return web.Response(status=404, text=f"Flow '{flow_url}' has no workflow")
+        return variant_response(request, artifact["variants"], "application/json", artifact["etag"])
+    except InvalidArtifact as e:
+        return web.Response(status=422, text=f"Flow '{flow_url}' cannot be loaded: {e}")
+    except Exception as e:
+        logger.error(f"{FLOWMSG}: Error in flow_artifact_handler: {e}")
+        return web.Response(status=500, text=str(e))
 
 async def flow_version_handler(request: web.Request) -> web.Response:
     return web.json_response({'version': APP_VERSION})
 
+async def asset_manifest_handler(request: web.Request) -> web.Response:
+    manifest = await asyncio.get_running_loop().run_in_executor(None, get_asset_manifest)
+    return web.json_response(manifest.to_json(), headers={'Cache-Control': REVALIDATE_CACHE_CONTROL})
+
 async def extension_node_map_handler(request: web.Request) -> web.Response:
     if EXTENSION_NODE_MAP_PATH.exists():
         with EXTENSION_NODE_MAP_PATH.open('r') as f:
@@ -330,15 +556,9 @@ async def uninstall_package_handler(request: web.Request) -> web.Response:
         return web.json_response({'status': 'error', 'message': f"An error occurred while uninstalling custom node '{package_name}': {e}"}, status=500)
 
 async def list_themes_handler(request: web.Request) -> web.Response:
-    themes_dir = CUSTOM_THEMES_DIR
     try:
-        if not themes_dir.exists():
-            logger.warning(f"Custom themes directory does not exist: {themes_dir}")
-            return web.json_response([], status=200)
-        
-        css_files = [file.name for file in themes_dir.iterdir() if file.is_file() and allowed_file(file.name)]
-        return web.json_response(css_files)
-    
+        registry = await asyncio.get_running_loop().run_in_executor(None, theme_registry.current)
+        return conditional_response(request, registry['listBody'], 'application/json', registry['listEtag'])
     except Exception as e:
         logger.error(f"Error listing theme files: {e}")
         return web.json_response({'error': 'Failed to list theme files.'}, status=500)
@@ -350,63 +570,41 @@ async def get_theme_css_handler(request: web.Request) -> web.Response:
         logger.warning(f"Attempt to access disallowed file type: {filename}")
         raise web.HTTPNotFound()
     
-    file_path = CUSTOM_THEMES_DIR / filename
-    
-    if not file_path.exists() or not file_path.is_file():
-        logger.warning(f"CSS file not found: {file_path}")
+    registry = await asyncio.get_running_loop().run_in_executor(None, theme_registry.current)
+    source = registry['sources'].get(filename)
+    if source is None:
+        logger.warning(f"CSS file not found: {CUSTOM_THEMES_DIR / filename}")
         raise web.HTTPNotFound()
     
+    data, etag = source
+    return conditional_response(request, data, 'text/css', etag)
+
+async def theme_index_handler(request: web.Request) -> web.Response:
+    registry = await asyncio.get_running_loop().run_in_executor(None, theme_registry.current)
+    index = registry['index']
+    return variant_response(request, index['variants'], 'application/json', index['etag'])
+
+async def combined_themes_handler(request: web.Request) -> web.Response:
+    registry = await asyncio.get_running_loop().run_in_executor(None, theme_registry.current)
+    combined = registry['combined']
+    # Only a URL carrying the current version may be pinned; anything else revalidates.
+    pinned = request.query.get('v') == registry['version']
+    cache_control = IMMUTABLE_CACHE_CONTROL if pinned else REVALIDATE_CACHE_CONTROL
+    return variant_response(request, combined['variants'], 'text/css', combined['etag'], cache_control)
+
+async def receive_flow_upload(request: web.Request, tmp_dir: Path):
     try:
-        return web.FileResponse(path=file_path)
-    except Exception as e:
-        logger.error(f"Error serving CSS file '{filename}': {e}")
-        raise web.HTTPInternalServerError(text="Internal Server Error")
+        upload = await read_flow_upload(request, tmp_dir, FLOW_CONFIG_MAX_BYTES, FLOW_UPLOAD_MAX_PART_BYTES,
+                                        FLOW_THUMBNAIL_MAX_BYTES, FLOW_UPLOAD_MAX_TOTAL_BYTES)
+        return upload, None
+    except UploadTooLarge as e:
+        return None, web.Response(status=413, text=str(e))
+    except InvalidUpload as e:
+        return None, web.Response(status=400, text=str(e))
 
 async def preview_flow_handler(request: web.Request) -> web.Response:
+    upload = None
     try:
-        reader = await request.multipart()
-        flow_config = None
-        wf_file = None
-        thumbnail_data = None
-        thumbnail_extension = None
-
-        while True:
-            part = await reader.next()
-            if part is None:
-                break
-
-            if part.name == 'flowConfig':
-                flow_config_content = await part.read(decode=True)
-                try:
-                    flow_config = json.loads(flow_config_content)
-                except json.JSONDecodeError:
-                    return web.Response(status=400, text="Invalid JSON format in 'flowConfig'")
-                
-                flow_url = flow_config.get('url', None)
-                if not flow_url:
-                    return web.Response(status=400, text="Missing 'url' in 'flowConfig'")
-
-            elif part.name == 'wf':
-                wf_file = await part.read(decode=False)
-
-            elif part.name == 'thumbnail':
-                thumbnail_str = await part.text()
-                match = re.match(r'data:(image/\w+);base64,(.+)', thumbnail_str)
-                if match:
-                    mime_type = match.group(1)
-                    base64_data = match.group(2)
-                    thumbnail_extension = mime_type.split('/')[1]
-
-                    try:
-                        thumbnail_data = base64.b64decode(base64_data)
-                    except base64.binascii.Error:
-                        return web.Response(status=400, text="Invalid Base64 encoding in 'thumbnail'")
-                else:
-                    return web.Response(status=400, text="Invalid data URL format for 'thumbnail'")
-
-        if not flow_config or not wf_file:
-            return web.Response(status=400, text="Missing 'flowConfig' or 'wf' in request")
-
         flow_id = "linker"
         if not flow_id:
             return web.Response(status=400, text="Missing 'id' in request body")
@@ -418,24 +616,26 @@ async def preview_flow_handler(request: web.Request) -> web.Response:
         if not flow_path.exists():
             return web.Response(status=404, text=f"Flow directory '{flow_id}' not found")
 
-        config_path = flow_path / FLOWS_CONFIG_FILE
-        with config_path.open('w', encoding='utf-8') as f:
-            json.dump(flow_config, f, indent=2)
+        upload, error = await receive_flow_upload(request, flow_path)
+        if error:
+            return error
 
-        if wf_file:
-            wf_json_path = flow_path / 'wf.json'
-            with wf_json_path.open('wb') as f:
-                f.write(wf_file)
+        flow_config = upload.flow_config
+        if not flow_config or not upload.wf_path:
+            return web.Response(status=400, text="Missing 'flowConfig' or 'wf' in request")
 
-        if thumbnail_data and thumbnail_extension:
+        files = {'wf.json': upload.wf_path}
+        thumbnail_extension = None
+        if upload.thumbnail_path:
+            thumbnail_extension = upload.thumbnail_mime.split('/')[1]
             thumbnail_filename = f"thumbnail.{thumbnail_extension}"
-            thumbnail_path = flow_path / thumbnail_filename
-            with thumbnail_path.open('wb') as f:
-                f.write(thumbnail_data)
+            files[thumbnail_filename] = upload.thumbnail_path
             flow_config['thumbnail'] = thumbnail_filename
-            with config_path.open('w', encoding='utf-8') as f:
-                json.dump(flow_config, f, indent=2)
+        files[FLOWS_CONFIG_FILE] = encode_json(flow_config)
+        await write_flow_files(flow_path, files)
+        invalidate_flow_artifact(flow_id)
 
+        if thumbnail_extension:
             logger.info(f"Thumbnail saved as '{thumbnail_filename}' in flow '{flow_id}'")
 
         return web.json_response({
@@ -447,6 +647,9 @@ async def preview_flow_handler(request: web.Request) -> web.Response:
     except Exception as e:
         logger.error(f"{FLOWMSG}: Error saving configuration: {e}")
         return web.Response(status=500, text=f"{FLOWMSG}: Error saving configuration: {str(e)}")
+    finally:
+        if upload is not None:
+            upload.cleanup()
 
 async def reset_preview_handler(request: web.Request) -> web.Response:
     try:
@@ -467,8 +670,8 @@ async def reset_preview_handler(request: web.Request) -> web.Response:
         if not def_flow_config_path.exists():
             return web.Response(status=404, text=f"Default flow configuration file 'defFlowConfig.json' not found in '{flow_id}'")
 
-        shutil.copy2(defwf_path, wf_path)
-        shutil.copy2(def_flow_config_path, flow_config_path)
+        await copy_flow_files(flow_path, {wf_path.name: defwf_path, flow_config_path.name: def_flow_config_path})
+        invalidate_flow_artifact(flow_id)
 
         logger.info(f"{FLOWMSG}: Preview reset successfully for flow '{flow_id}'.")
         return web.json_response({
@@ -480,59 +683,28 @@ async def reset_preview_handler(request: web.Request) -> web.Response:
         logger.error(f"{FLOWMSG}: Error resetting preview: {e}")
         return web.Response(status=500, text=f"{FLOWMSG}: Error resetting preview: {str(e)}")
 
+async def process_flow_thumbnail(upload: FlowUpload):
+    if not upload.thumbnail_path:
+        return None, None
+    try:
+        return await image_pool.run(make_flow_thumbnail, str(upload.thumbnail_path)), None
+    except Exception as e:
+        logger.error(f"{FLOWMSG}: Error processing thumbnail: {e}")
+        return None, web.Response(status=400, text="Invalid image data in 'thumbnail'")
+
 async def create_flow_handler(request: web.Request) -> web.Response:
+    upload = None
     try:
-        reader = await request.multipart()
-        flow_config = None
-        wf_file = None
-        flow_url = None
-        thumbnail_data = None
-
-        while True:
-            part = await reader.next()
-            if part is None:
-                break
-
-            if part.name == 'flowConfig':
-                flow_config_content = await part.read(decode=True)
-                try:
-                    flow_config = json.loads(flow_config_content)
-                except json.JSONDecodeError:
-                    return web.Response(status=400, text="Invalid JSON format in 'flowConfig'")
-                
-                flow_url = flow_config.get('url', None)
-                if not flow_url:
-                    return web.Response(status=400, text="Missing 'url' in 'flowConfig'")
-
-            elif part.name == 'wf':
-                wf_file = await part.read(decode=False)
-
-            elif part.name == 'thumbnail':
-                thumbnail_str = await part.text()
-                match = re.match(r'data:(image/\w+);base64,(.+)', thumbnail_str)
-                if match:
-                    mime_type = match.group(1)
-                    base64_data = match.group(2)
-                    try:
-                        thumbnail_bytes = base64.b64decode(base64_data)
-                        image = Image.open(BytesIO(thumbnail_bytes))
-                        if image.mode in ("RGBA", "P"):
-                            image = image.convert("RGB")
-                        width_percent = (468 / float(image.size[0]))
-                        new_height = int((float(image.size[1]) * float(width_percent)))
-                        image = image.resize((468, new_height), Image.Resampling.LANCZOS)
-                        buffered = BytesIO()
-                        image.save(buffered, format="JPEG")
-                        thumbnail_data = buffered.getvalue()
-                    except Exception as e:
-                        logger.error(f"{FLOWMSG}: Error processing thumbnail: {e}")
-                        return web.Response(status=400, text="Invalid image data in 'thumbnail'")
-                else:
-                    return web.Response(status=400, text="Invalid data URL format for 'thumbnail'")
-
-        if not flow_config or not wf_file:
+        FLOWS_PATH.mkdir(parents=True, exist_ok=True)
+        upload, error = await receive_flow_upload(request, FLOWS_PATH)
+        if error:
+            return error
+
+        flow_config = upload.flow_config
+        if not flow_config or not upload.wf_path:
             return web.Response(status=400, text="Missing 'flowConfig' or 'wf' in request")
 
+        flow_url = flow_config['url']
         if not SAFE_FOLDER_NAME_REGEX.match(flow_url):
             return web.Response(status=400, text="Invalid 'url' in 'flowConfig'. Only letters, numbers, dashes, and underscores are allowed.")
 
@@ -540,35 +712,31 @@ async def create_flow_handler(request: web.Request) -> web.Response:
         if flow_folder.exists():
             return web.Response(status=400, text=f"Flow with url '{flow_url}' already exists")
 
-        flow_folder.mkdir(parents=True, exist_ok=False)
-
-        flow_config_path = flow_folder / FLOWS_CONFIG_FILE
-        with flow_config_path.open('w', encoding='utf-8') as f:
-            json.dump(flow_config, f, indent=2)
+        index_template_path = CORE_PATH / 'templates' / 'index.html'
+        if not index_template_path.exists():
+            return web.Response(status=500, text="Template 'index.html' not found")
 
-        wf_json_path = flow_folder / 'wf.json'
-        with wf_json_path.open('wb') as f:
-            f.write(wf_file)
+        thumbnail_data, error = await process_flow_thumbnail(upload)
+        if error:
+            return error
 
+        files = {
+            FLOWS_CONFIG_FILE: encode_json(flow_config),
+            'wf.json': upload.wf_path,
+            'index.html': FileCopy(index_template_path),
+        }
         if thumbnail_data:
-            media_folder = flow_folder / 'media'
-            media_folder.mkdir(exist_ok=True)
-            thumbnail_filename = "thumbnail.jpg"
-            thumbnail_path = media_folder / thumbnail_filename
-            with thumbnail_path.open('wb') as f:
-                f.write(thumbnail_data)
-
-            with flow_config_path.open('w', encoding='utf-8') as f:
-                json.dump(flow_config, f, indent=2)
+            files['media/thumbnail.jpg'] = thumbnail_data
 
-            logger.info(f"Thumbnail saved as '{thumbnail_filename}' in flow '{flow_url}'")
+        try:
+            await write_flow_files(flow_folder, files, create=True)
+        except FileExistsError:
+            return web.Response(status=400, text=f"Flow with url '{flow_url}' already exists")
+        await compact_flow(flow_folder)
+        flow_catalog.refresh_flow(flow_folder)
 
-        index_template_path = CORE_PATH / 'templates' / 'index.html'
-        if not index_template_path.exists():
-            return web.Response(status=500, text="Template 'index.html' not found")
-        
-        index_destination_path = flow_folder / 'index.html'
-        shutil.copy2(index_template_path, index_destination_path)
+        if thumbnail_data:
+            logger.info(f"Thumbnail saved as 'thumbnail.jpg' in flow '{flow_url}'")
 
         logger.info(f"{FLOWMSG}: Flow '{flow_url}' created successfully.")
         return web.json_response({'status': 'success', 'message': f"Flow '{flow_url}' created successfully."})
@@ -576,60 +744,23 @@ async def create_flow_handler(request: web.Request) -> web.Response:
     except Exception as e:
         logger.error(f"{FLOWMSG}: Error creating flow: {e}")
         return web.Response(status=500, text=f"{FLOWMSG}: Error creating flow: {str(e)}")
+    finally:
+        if upload is not None:
+            upload.cleanup()
 
 async def update_flow_handler(request: web.Request) -> web.Response:
+    upload = None
     try:
-        reader = await request.multipart()
-        flow_config = None
-        wf_file = None
-        flow_url = None
-        thumbnail_data = None
-
-        while True:
-            part = await reader.next()
-            if part is None:
-                break
-
-            if part.name == 'flowConfig':
-                flow_config_content = await part.read(decode=True)
-                try:
-                    flow_config = json.loads(flow_config_content)
-                except json.JSONDecodeError:
-                    return web.Response(status=400, text="Invalid JSON format in 'flowConfig'")
-                
-                flow_url = flow_config.get('url', None)
-                if not flow_url:
-                    return web.Response(status=400, text="Missing 'url' in 'flowConfig'")
-
-            elif part.name == 'wf':
-                wf_file = await part.read(decode=False)
-
-            elif part.name == 'thumbnail':
-                thumbnail_str = await part.text()
-                match = re.match(r'data:(image/\w+);base64,(.+)', thumbnail_str)
-                if match:
-                    mime_type = match.group(1)
-                    base64_data = match.group(2)
-                    try:
-                        thumbnail_bytes = base64.b64decode(base64_data)
-                        image = Image.open(BytesIO(thumbnail_bytes))
-                        if image.mode in ("RGBA", "P"):
-                            image = image.convert("RGB")
-                        width_percent = (468 / float(image.size[0]))
-                        new_height = int((float(image.size[1]) * float(width_percent)))
-                        image = image.resize((468, new_height), Image.Resampling.LANCZOS)
-                        buffered = BytesIO()
-                        image.save(buffered, format="JPEG")
-                        thumbnail_data = buffered.getvalue()
-                    except Exception as e:
-                        logger.error(f"{FLOWMSG}: Error processing thumbnail: {e}")
-                        return web.Response(status=400, text="Invalid image data in 'thumbnail'")
-                else:
-                    return web.Response(status=400, text="Invalid data URL format for 'thumbnail'")
+        FLOWS_PATH.mkdir(parents=True, exist_ok=True)
+        upload, error = await receive_flow_upload(request, FLOWS_PATH)
+        if error:
+            return error
 
+        flow_config = upload.flow_config
         if not flow_config:
             return web.Response(status=400, text="Missing 'flowConfig' in request")
 
+        flow_url = flow_config['url']
         if not SAFE_FOLDER_NAME_REGEX.match(flow_url):
             return web.Response(status=400, text="Invalid 'url' in 'flowConfig'. Only letters, numbers, dashes, and underscores are allowed.")
 
@@ -637,27 +768,23 @@ async def update_flow_handler(request: web.Request) -> web.Response:
         if not flow_folder.exists():
             return web.Response(status=400, text=f"Flow with url '{flow_url}' does not exist")
 
-        flow_config_path = flow_folder / FLOWS_CONFIG_FILE
-        with flow_config_path.open('w', encoding='utf-8') as f:
-            json.dump(flow_config, f, indent=2)
-
-        if wf_file:
-            wf_json_path = flow_folder / 'wf.json'
-            with wf_json_path.open('wb') as f:
-                f.write(wf_file)
+        thumbnail_data, error = await process_flow_thumbnail(upload)
+        if error:
+            return error
 
+        files = {}
+        if upload.wf_path:
+            files['wf.json'] = upload.wf_path
         if thumbnail_data:
-            media_folder = flow_folder / 'media'
-            media_folder.mkdir(exist_ok=True)
-            thumbnail_filename = "thumbnail.jpg"
-            thumbnail_path = media_folder / thumbnail_filename
-            with thumbnail_path.open('wb') as f:
-                f.write(thumbnail_data)
+            files['media/thumbnail.jpg'] = thumbnail_data
+        # The config goes last: its mtime is what the catalog watches.
+        files[FLOWS_CONFIG_FILE] = encode_json(flow_config)
+        await write_flow_files(flow_folder, files)
+        invalidate_flow_artifact(flow_url)
+        flow_catalog.refresh_flow(flow_folder)
 
-            with flow_config_path.open('w', encoding='utf-8') as f:
-                json.dump(flow_config, f, indent=2)
-
-            logger.info(f"Thumbnail updated as '{thumbnail_filename}' in flow '{flow_url}'")
+        if thumbnail_data:
+            logger.info(f"Thumbnail updated as 'thumbnail.jpg' in flow '{flow_url}'")
 
         logger.info(f"{FLOWMSG}: Flow '{flow_url}' updated successfully.")
         return web.json_response({'status': 'success', 'message': f"Flow '{flow_url}' updated successfully."})
@@ -665,6 +792,9 @@ async def update_flow_handler(request: web.Request) -> web.Response:
     except Exception as e:
         logger.error(f"{FLOWMSG}: Error updating flow: {e}")
         return web.Response(status=500, text=f"{FLOWMSG}: Error updating flow: {str(e)}")
+    finally:
+        if upload is not None:
+            upload.cleanup()
 
 async def delete_flow_handler(request: web.Request) -> web.Response:
     try:
@@ -679,7 +809,9 @@ async def delete_flow_handler(request: web.Request) -> web.Response:
         if not flow_folder.exists():
             return web.Response(status=400, text=f"Flow with url '{flow_url}' does not exist")
 
-        shutil.rmtree(flow_folder)
+        await delete_flow_folder(flow_folder)
+        invalidate_flow_artifact(flow_url)
+        flow_catalog.refresh_flow(flow_folder)
 
         logger.info(f"{FLOWMSG}: Flow '{flow_url}' deleted successfully.")
         return web.json_response({'status': 'success', 'message': f"Flow '{flow_url}' deleted successfully."})
@@ -688,6 +820,117 @@ async def delete_flow_handler(request: web.Request) -> web.Response:
         logger.error(f"{FLOWMSG}: Error deleting flow: {e}")
         return web.Response(status=500, text=f"{FLOWMSG}: Error deleting flow: {str(e)}")
 
+def is_truthy(value) -> bool:
+    return value is not None and value.lower() in ('1', 'true', 'yes')
+
+async def export_flow_handler(request: web.Request) -> web.Response:
+    fmt = request.query.get('format', 'zip')
+    if fmt not in BUNDLE_FORMATS:
+        return web.Response(status=400, text=f"Invalid 'format', expected one of {list(BUNDLE_FORMATS)}")
+
+    if is_truthy(request.query.get('all')):
+        flow_urls = None
+        flow_dirs = sorted(flow_catalog.flow_dirs())
+    else:
+        flow_urls = [u for value in request.query.getall('url', []) for u in value.split(',') if u]
+        if not flow_urls:
+            return web.Response(status=400, text="Missing 'url' parameter")
+        flow_dirs = []
+        for flow_url in flow_urls:
+            entry = flow_catalog.get(flow_url)
+            if entry is None:
+                return web.Response(status=404, text=f"Flow with url '{flow_url}' does not exist")
+            flow_dirs.append(entry['dir'])
+
+    content_type, extension = BUNDLE_FORMATS[fmt]
+    filename = flow_urls[0] if flow_urls and len(flow_urls) == 1 else "flows"
+    response = web.StreamResponse(headers={
+        hdrs.CONTENT_TYPE: content_type,
+        hdrs.CONTENT_DISPOSITION: f'attachment; filename="{filename}.{extension}"',
+    })
+    await response.prepare(request)
+    bundle = BundleStream(flow_dirs, fmt)
+    try:
+        async for chunk in bundle:
+            await response.write(chunk)
+    except Exception as e:
+        logger.error(f"{FLOWMSG}: Error exporting flows: {e}")
+        raise
+    finally:
+        bundle.close()
+    await response.write_eof()
+    return response
+
+async def import_flow_handler(request: web.Request) -> web.Response:
+    overwrite = is_truthy(request.query.get('overwrite'))
+    archive_path = None
+    staging = None
+    loop = asyncio.get_running_loop()
+    try:
+        FLOWS_PATH.mkdir(parents=True, exist_ok=True)
+        if request.content_type.startswith("multipart/"):
+            reader = await request.multipart()
+            while True:
+                part = await reader.next()
+                if part is None:
+                    return web.Response(status=400, text="Missing 'bundle' part")
+                if part.name == 'bundle':
+                    chunks = iter_part_chunks(part)
+                    break
+        else:
+            chunks = request.content.iter_chunked(UPLOAD_CHUNK_SIZE)
+
+        try:
+            archive_path = await stream_to_temp_file(chunks, FLOWS_PATH, FLOW_BUNDLE_MAX_BYTES)
+        except UploadTooLarge as e:
+            return web.Response(status=413, text=str(e))
+
+        try:
+            staging, flows = await loop.run_in_executor(
+                None, extract_bundle, archive_path, FLOWS_PATH, FLOW_BUNDLE_MAX_EXTRACTED_BYTES)
+        except InvalidBundle as e:
+            return web.Response(status=400, text=str(e))
+
+        try:
+            plan = await loop.run_in_executor(None, plan_import, staging, flows, FLOWS_PATH)
+        except InvalidBundle as e:
+            return web.Response(status=400, text=str(e))
+        conflicts = [url or name for name, url, _, exists in plan if exists]
+        if conflicts and not overwrite:
+            return web.Response(status=409, text=f"Flows already exist: {', '.join(conflicts)}. Pass overwrite=1 to replace them.")
+
+        imported, skipped = [], []
+        for name, url, flow_folder, _ in plan:
+            async with flow_lock(flow_folder):
+                installed = await loop.run_in_executor(None, install_staged_flow, staging / name, flow_folder, overwrite)
+            if installed:
+                await compact_flow(flow_folder)
+                invalidate_flow_artifact(url or flow_folder.name)
+                flow_catalog.refresh_flow(flow_folder)
+                imported.append(name)
+            else:
+                skipped.append(name)
+
+        logger.info(f"{FLOWMSG}: Imported {len(imported)} flows, skipped {len(skipped)} existing.")
+        return web.json_response({'status': 'success', 'imported': imported, 'skipped': skipped})
+
+    except Exception as e:
+        logger.error(f"{FLOWMSG}: Error importing flows: {e}")
+        return web.Response(status=500, text=f"{FLOWMSG}: Error importing flows: {str(e)}")
+    finally:
+        if archive_path is not None:
+            archive_path.unlink(missing_ok=True)
+        if staging is not None:
+            await loop.run_in_executor(None, lambda: shutil.rmtree(staging, ignore_errors=True))
+
+async def compact_flows_handler(request: web.Request) -> web.Response:
+    try:
+        report = await compact_flows(FLOWS_PATH)
+        return web.json_response(report)
+    except Exception as e:
+        logger.error(f"{FLOWMSG}: Error compacting flows: {e}")
+        return web.Response(status=500, text=f"{FLOWMSG}: Error compacting flows: {str(e)}")
+
 def allowed_file(filename: str) -> bool:
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
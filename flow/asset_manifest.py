@@ -0,0 +1,147 @@
+import os
+import re
+import time
+import asyncio
+import hashlib
+import mimetypes
+import threading
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+from aiohttp import web
+from .constants import APP_VERSION, CORE_PATH
+from .http_cache import IMMUTABLE_CACHE_CONTROL, make_etag, compress_variants, variant_response
+from .preview_cache import response_cache, MISSING
+from .static_assets import precompressed_file_response
+
+ASSET_URL_PREFIX = "/core/"
+ASSET_RECHECK_INTERVAL = 2.0
+REWRITE_SUFFIXES = frozenset({".js", ".mjs", ".css", ".html"})
+# Absolute /core/ references inside quotes or url(...); the theme endpoints are
+# generated per request and stay on their plain URLs.
+CORE_REFERENCE_REGEX = re.compile(rb"(?<=[\"'`(])/core/(?!css/themes/)")
+
+def hash_bytes(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()[:16]
+
+class AssetManifest:
+    # Maps every file under web/core to a content hash. The digest of the whole
+    # manifest (plus APP_VERSION) names the build, and every asset is served
+    # under /core/@<build>/ so relative ES module imports stay inside one
+    # immutable tree.
+    def __init__(self, root: Path):
+        self.root = root
+        self.build = ""
+        self.assets: Dict[str, Dict[str, Any]] = {}
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def prefix(self) -> str:
+        return f"{ASSET_URL_PREFIX}@{self.build}/"
+
+    def url_for(self, relative: str) -> str:
+        return f"{self.prefix}{relative}"
+
+    def _walk(self):
+        for dirpath, dirs, files in os.walk(self.root):
+            dirs[:] = [d for d in dirs if not d.startswith('.')]
+            for name in files:
+                if name.startswith('.') or name.endswith(('.gz', '.br')):
+                    continue
+                path = Path(dirpath) / name
+                try:
+                    st = path.stat()
+                except OSError:
+                    continue
+                yield path.relative_to(self.root).as_posix(), path, (st.st_mtime_ns, st.st_size)
+
+    def refresh(self) -> bool:
+        with self._lock:
+            self._checked = time.monotonic()
+            if not self.root.is_dir():
+                return False
+            assets = {}
+            changed = False
+            for relative, path, signature in self._walk():
+                entry = self.assets.get(relative)
+                if entry is None or entry["signature"] != signature:
+                    try:
+                        entry = {"signature": signature, "hash": hash_bytes(path.read_bytes())}
+                    except OSError:
+                        continue
+                    changed = True
+                assets[relative] = entry
+            if not changed and assets.keys() == self.assets.keys():
+                return False
+            digest = hashlib.sha256(APP_VERSION.encode('utf-8'))
+            for relative in sorted(assets):
+                digest.update(f"\0{relative}\0{assets[relative]['hash']}".encode('utf-8'))
+            self.assets = assets
+            self.build = digest.hexdigest()[:12]
+            return True
+
+    def current(self) -> "AssetManifest":
+        if time.monotonic() - self._checked >= ASSET_RECHECK_INTERVAL:
+            self.refresh()
+        return self
+
+    def rewrite(self, data: bytes) -> bytes:
+        return CORE_REFERENCE_REGEX.sub(self.prefix.encode('utf-8'), data)
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            "build": self.build,
+            "version": APP_VERSION,
+            "assets": {relative: {"hash": entry["hash"], "url": self.url_for(relative)}
+                       for relative, entry in self.assets.items()},
+        }
+
+asset_manifest = AssetManifest(CORE_PATH)
+
+def get_asset_manifest() -> AssetManifest:
+    return asset_manifest.current()
+
+def load_versioned_asset(manifest: AssetManifest, relative: str, file_path: Path) -> Tuple[Dict[str, Any], Optional[str]]:
+    entry = manifest.assets[relative]
+    key = ("core-asset", manifest.build, relative)
+    cached = response_cache.get(key)
+    if cached is MISSING:
+        data = file_path.read_bytes()
+        if hash_bytes(data) != entry["hash"]:
+            # Changed since the manifest was built; the caller redirects to the new build.
+            return None, None
+        cached = {"variants": compress_variants(manifest.rewrite(data)), "etag": make_etag(manifest.build, entry["hash"])}
+        response_cache.put(key, cached, sum(len(v) for v in cached["variants"].values()))
+    return cached, mimetypes.guess_type(file_path.name)[0] or "application/octet-stream"
+
+async def versioned_asset_handler(request: web.Request) -> web.StreamResponse:
+    loop = asyncio.get_running_loop()
+    manifest = await loop.run_in_executor(None, get_asset_manifest)
+    relative = request.match_info["filename"]
+    entry = manifest.assets.get(relative)
+    if entry is None:
+        raise web.HTTPNotFound()
+
+    file_path = None
+    if request.match_info["build"] == manifest.build:
+        # Only names the manifest walked itself get this far, so the join cannot escape the root.
+        file_path = manifest.root / relative
+        try:
+            st = file_path.stat()
+            current = (st.st_mtime_ns, st.st_size) == entry["signature"]
+        except OSError:
+            current = False
+        if not current:
+            await loop.run_in_executor(None, manifest.refresh)
+            file_path = None
+
+    if file_path is not None and file_path.suffix in REWRITE_SUFFIXES:
+        cached, content_type = await loop.run_in_executor(None, load_versioned_asset, manifest, relative, file_path)
+        if cached is not None:
+            return variant_response(request, cached["variants"], content_type, cached["etag"], IMMUTABLE_CACHE_CONTROL)
+        await loop.run_in_executor(None, manifest.refresh)
+    elif file_path is not None:
+        return await precompressed_file_response(request, file_path, {"Cache-Control": IMMUTABLE_CACHE_CONTROL})
+
+    # An older build (or a file that changed under this one): never pin it, point at the current build.
+    raise web.HTTPTemporaryRedirect(manifest.url_for(relative), headers={"Cache-Control": "no-store"})
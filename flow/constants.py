@@ -1,11 +1,11 @@
 import logging
 import mimetypes
+import os
 from pathlib import Path
 import re
 APP_NAME = "Flow"
 APP_VERSION = "0.5.1" 
 FLOWMSG = f"\033[38;5;129mFlow - {APP_VERSION}\033[0m"
-APP_CONFIGS = []
 
 CURRENT_DIR = Path(__file__).parent
 ROOT_DIR = CURRENT_DIR.parent
@@ -15,6 +15,7 @@ FLOW_PATH = WEBROOT / "flow"
 FLOWS_PATH = WEBROOT / "flows"
 LINKER_PATH = WEBROOT / "linker"
 CUSTOM_THEMES_DIR = WEBROOT / 'custom-themes'
+DATA_DIR = CURRENT_DIR / 'data'
 WEB_DIRECTORY = "web/core/js/common/scripts"
 
 CUSTOM_NODES_DIR = ROOT_DIR.parent
@@ -23,7 +24,27 @@ EXTENSION_NODE_MAP_PATH = ROOT_DIR.parent / "ComfyUI-Manager" / "extension-node-
 FLOWS_DOWNLOAD_PATH = 'https://github.com/diStyApps/flows_lib'
 
 SAFE_FOLDER_NAME_REGEX = re.compile(r'^[\w\-]+$')
+PREVIEW_ID_REGEX = re.compile(r'^[0-9a-f]{16}$')
 ALLOWED_EXTENSIONS = {'css'}
+PREVIEW_CACHE_MAX_BYTES = int(os.environ.get('FLOW_PREVIEW_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get('FLOW_RESPONSE_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+MODEL_PREVIEW_MAX_UPLOAD_BYTES = int(os.environ.get('FLOW_PREVIEW_MAX_UPLOAD_BYTES', 32 * 1024 * 1024))
+FLOW_CONFIG_MAX_BYTES = int(os.environ.get('FLOW_CONFIG_MAX_BYTES', 1024 * 1024))
+FLOW_UPLOAD_MAX_PART_BYTES = int(os.environ.get('FLOW_UPLOAD_MAX_PART_BYTES', 256 * 1024 * 1024))
+FLOW_THUMBNAIL_MAX_BYTES = int(os.environ.get('FLOW_THUMBNAIL_MAX_BYTES', 48 * 1024 * 1024))
+FLOW_UPLOAD_MAX_TOTAL_BYTES = int(os.environ.get('FLOW_UPLOAD_MAX_TOTAL_BYTES', 512 * 1024 * 1024))
+FLOW_BUNDLE_MAX_BYTES = int(os.environ.get('FLOW_BUNDLE_MAX_BYTES', 2 * 1024 * 1024 * 1024))
+FLOW_BUNDLE_MAX_EXTRACTED_BYTES = int(os.environ.get('FLOW_BUNDLE_MAX_EXTRACTED_BYTES', 4 * 1024 * 1024 * 1024))
+IMAGE_WORKERS = int(os.environ.get('FLOW_IMAGE_WORKERS', min(4, os.cpu_count() or 1)))
+IMAGE_QUEUE_LIMIT = int(os.environ.get('FLOW_IMAGE_QUEUE_LIMIT', 32))
+MODEL_PREVIEW_DISK_QUOTA_BYTES = int(os.environ.get('FLOW_PREVIEW_DISK_QUOTA_BYTES', 0))
+PREVIEW_MAINTENANCE_INTERVAL = int(os.environ.get('FLOW_PREVIEW_MAINTENANCE_INTERVAL', 6 * 60 * 60))
+# Off by default: a model folder that is briefly missing (unmounted drive, renamed path) would lose its previews.
+PREVIEW_MAINTENANCE_REMOVE_ORPHANS = os.environ.get('FLOW_PREVIEW_REMOVE_ORPHANS', '0') == '1'
+FLOW_CATALOG_POLL_INTERVAL = float(os.environ.get('FLOW_CATALOG_POLL_INTERVAL', 5))
+FLOW_PAGE_INLINE_MAX_BYTES = int(os.environ.get('FLOW_PAGE_INLINE_MAX_BYTES', 512 * 1024))
+FLOWS_SYNC_ON_STARTUP = os.environ.get('FLOW_SYNC_ON_STARTUP', '1') != '0'
+FLOWS_SYNC_TIMEOUT = float(os.environ.get('FLOW_SYNC_TIMEOUT', 300))
 mimetypes.add_type('application/javascript', '.js')
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -1,66 +1,179 @@
-import subprocess
-import tempfile
+import os
+import time
 import shutil
+import asyncio
+import filecmp
+import tempfile
 from pathlib import Path
-from .constants import FLOWS_DOWNLOAD_PATH, FLOWS_PATH, FLOWS_TO_REMOVE, FLOWMSG, logger
+from typing import Any, Dict, Iterator, List
+from aiohttp import web
+from .constants import (
+    FLOWS_DOWNLOAD_PATH, FLOWS_PATH, FLOWS_TO_REMOVE, FLOWS_SYNC_ON_STARTUP, FLOWS_SYNC_TIMEOUT, FLOWMSG, logger
+)
+from .flow_catalog import flow_catalog
+from .flow_storage import flow_lock
+from .flow_bundles import install_staged_flow
+from .flow_blobs import compact_flow
+from .flow_artifacts import invalidate_flow_artifact
+
+SYNCING_PREFIX = ".syncing-"
+SKIPPED_REPO_ITEMS = ('.git', '.github')
+
+_status: Dict[str, Any] = {
+    "state": "idle", "phase": None, "startedAt": None, "finishedAt": None, "durationMs": None,
+    "flowsTotal": 0, "flowsInstalled": 0, "flowsUpdated": 0, "flowsRemoved": 0, "error": None,
+}
+
+def get_sync_status() -> Dict[str, Any]:
+    return dict(_status, catalogFlows=len(flow_catalog), catalogVersion=flow_catalog.version)
 
-def download_update_flows() -> None:
+def remove_retired_flows() -> int:
+    removed = 0
+    for flow in FLOWS_TO_REMOVE:
+        flow_path = FLOWS_PATH / flow
+        if flow_path.is_dir():
+            shutil.rmtree(flow_path)
+            removed += 1
+    if FLOWS_PATH.is_dir():
+        # Left behind by a sync that was interrupted mid-install.
+        for leftover in FLOWS_PATH.glob(f"{SYNCING_PREFIX}*"):
+            shutil.rmtree(leftover, ignore_errors=True)
+    return removed
+
+def changed_files(src: Path, dest: Path) -> Iterator[str]:
+    for root, dirs, files in os.walk(src):
+        dirs[:] = [d for d in dirs if d not in SKIPPED_REPO_ITEMS]
+        for name in files:
+            relative = (Path(root) / name).relative_to(src)
+            target = dest / relative
+            if not target.is_file() or not filecmp.cmp(src / relative, target, shallow=False):
+                yield relative.as_posix()
+
+def _link_or_copy(src: str, dest: str) -> None:
     try:
-        for flow in FLOWS_TO_REMOVE:
-            flow_path = FLOWS_PATH / flow
-            if flow_path.exists() and flow_path.is_dir():
-                # logger.info(f"{FLOWMSG}: Removing existing flow directory '{flow}'")
-                shutil.rmtree(flow_path)
-                # logger.debug(f"{FLOWMSG}: Successfully removed '{flow}'")
+        os.link(src, dest)
+    except OSError:
+        shutil.copy2(src, dest)
 
-        with tempfile.TemporaryDirectory() as tmpdirname:
-            temp_repo_path = Path(tmpdirname) / "Flows"
-            logger.info(f"{FLOWMSG}: Downloading and Upading Flows")
+def stage_flow_update(src: Path, dest: Path) -> bool:
+    changes = list(changed_files(src, dest))
+    if not changes:
+        return False
+    staging = Path(tempfile.mkdtemp(dir=dest.parent, prefix=f"{SYNCING_PREFIX}{dest.name}-"))
+    try:
+        staged = staging / dest.name
+        if dest.is_dir():
+            # Keep whatever the user added to the folder; hard links make the copy cheap.
+            shutil.copytree(dest, staged, copy_function=_link_or_copy)
+        else:
+            staged.mkdir()
+        for relative in changes:
+            target = staged / relative
+            target.parent.mkdir(parents=True, exist_ok=True)
+            # target may be a link shared with the live folder or the blob store; never write through it.
+            target.unlink(missing_ok=True)
+            shutil.copy2(src / relative, target)
+        install_staged_flow(staged, dest, overwrite=True)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    return True
 
-            result = subprocess.run(
-                ['git', 'clone', FLOWS_DOWNLOAD_PATH, str(temp_repo_path)],
-                capture_output=True,
-                text=True
-            )
-            if result.returncode != 0:
-                logger.error(f"{FLOWMSG}: Failed to clone flows repository:\n{result.stderr}")
-                return
-            else:
-                # logger.debug(f"{FLOWMSG}: Successfully cloned flows repository")
-                pass
+def copy_repo_file(src: Path, dest: Path) -> bool:
+    if dest.is_file() and filecmp.cmp(src, dest, shallow=False):
+        return False
+    dest.unlink(missing_ok=True)
+    shutil.copy2(src, dest)
+    return True
 
-            if not FLOWS_PATH.exists():
-                FLOWS_PATH.mkdir(parents=True)
-                # logger.debug(f"{FLOWMSG}: Created flows directory at '{FLOWS_PATH}'")
+async def clone_flows_repo(target: Path, timeout: float) -> None:
+    proc = await asyncio.create_subprocess_exec(
+        'git', 'clone', '--quiet', '--depth', '1', FLOWS_DOWNLOAD_PATH, str(target),
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE,
+        env=dict(os.environ, GIT_TERMINAL_PROMPT='0'),
+    )
+    try:
+        _, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+    except BaseException:
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+        raise
+    if proc.returncode != 0:
+        raise RuntimeError(f"git clone failed: {stderr.decode('utf-8', errors='replace').strip()}")
+
+async def install_flows(repo_path: Path) -> None:
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, lambda: FLOWS_PATH.mkdir(parents=True, exist_ok=True))
+    items: List[Path] = [item for item in sorted(repo_path.iterdir()) if item.name not in SKIPPED_REPO_ITEMS]
+    _status["flowsTotal"] = sum(1 for item in items if item.is_dir())
+    for item in items:
+        dest = FLOWS_PATH / item.name
+        if not item.is_dir():
+            await loop.run_in_executor(None, copy_repo_file, item, dest)
+            continue
+        async with flow_lock(dest):
+            updated = await loop.run_in_executor(None, stage_flow_update, item, dest)
+        if updated:
+            await compact_flow(dest)
+            invalidate_flow_artifact(item.name)
+            _status["flowsUpdated"] += 1
+        _status["flowsInstalled"] += 1
 
-            for item in temp_repo_path.iterdir():
-                if item.name in ['.git', '.github']:
-                    # logger.debug(f"{FLOWMSG}: Skipping directory '{item.name}'")
-                    continue
-                dest_item = FLOWS_PATH / item.name
-                if item.is_dir():
-                    if dest_item.exists():
-                        # logger.info(f"{FLOWMSG}: Updating existing directory '{item.name}'")
-                        _copy_directory(item, dest_item)
-                    else:
-                        shutil.copytree(item, dest_item)
-                        # logger.info(f"{FLOWMSG}: Copied new directory '{item.name}'")
-                else:
-                    shutil.copy2(item, dest_item)
-                    # logger.info(f"{FLOWMSG}: Copied file '{item.name}'")
+async def run_flows_sync(timeout: float = FLOWS_SYNC_TIMEOUT) -> Dict[str, Any]:
+    if _status["state"] == "running":
+        return get_sync_status()
+    loop = asyncio.get_running_loop()
+    started = time.perf_counter()
+    _status.update(
+        state="running", phase="removing", startedAt=time.time(), finishedAt=None, durationMs=None,
+        flowsTotal=0, flowsInstalled=0, flowsUpdated=0, flowsRemoved=0, error=None,
+    )
+    # Folders are swapped in one at a time; the catalog only picks them up in a single scan at the end.
+    flow_catalog.paused = True
+    workdir = None
+    try:
+        try:
+            _status["flowsRemoved"] = await loop.run_in_executor(None, remove_retired_flows)
+            workdir = Path(await loop.run_in_executor(None, tempfile.mkdtemp))
+            _status["phase"] = "cloning"
+            logger.info(f"{FLOWMSG}: Syncing the flows library in the background")
+            await clone_flows_repo(workdir / "Flows", timeout)
+            _status["phase"] = "installing"
+            await install_flows(workdir / "Flows")
+            _status["state"] = "succeeded"
+        except asyncio.CancelledError:
+            _status.update(state="cancelled", phase=None)
+            raise
+        except asyncio.TimeoutError:
+            _status.update(state="timeout", error=f"git clone did not finish within {timeout:g} s")
+            logger.warning(f"{FLOWMSG}: Flows library sync timed out after {timeout:g} s, using the flows on disk")
+        except Exception as e:
+            _status.update(state="failed", error=str(e))
+            logger.error(f"{FLOWMSG}: Flows library sync failed, using the flows on disk: {e}")
+    finally:
+        flow_catalog.paused = False
+        if workdir is not None:
+            await loop.run_in_executor(None, lambda: shutil.rmtree(workdir, ignore_errors=True))
 
-            logger.info(f"{FLOWMSG}: Flows have been updated successfully.")
+    _status["phase"] = "publishing"
+    try:
+        await loop.run_in_executor(None, flow_catalog.scan)
     except Exception as e:
-        logger.error(f"{FLOWMSG}: An error occurred while downloading or updating flows: {e}")
+        logger.error(f"{FLOWMSG}: Flow catalog scan failed: {e}")
+    _status.update(phase=None, finishedAt=time.time(), durationMs=round((time.perf_counter() - started) * 1000, 1))
+    if _status["state"] == "succeeded":
+        logger.info(
+            f"{FLOWMSG}: Flows library synced in {_status['durationMs']:.0f} ms, "
+            f"{_status['flowsUpdated']} of {_status['flowsTotal']} flows updated"
+        )
+    return get_sync_status()
 
-def _copy_directory(src: Path, dest: Path) -> None:
-    for item in src.iterdir():
-        if item.name in ['.git', '.github']:
-            continue
-        dest_item = dest / item.name
-        if item.is_dir():
-            if not dest_item.exists():
-                dest_item.mkdir()
-            _copy_directory(item, dest_item)
-        else:
-            shutil.copy2(item, dest_item)
+async def start_flows_sync(app: web.Application) -> None:
+    if FLOWS_SYNC_ON_STARTUP:
+        app["flow_sync"] = asyncio.get_running_loop().create_task(run_flows_sync())
+
+async def stop_flows_sync(app: web.Application) -> None:
+    task = app.get("flow_sync")
+    if task is not None:
+        task.cancel()
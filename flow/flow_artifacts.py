@@ -0,0 +1,132 @@
+import json
+import hashlib
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from .constants import EXTENSION_NODE_MAP_PATH, FLOWS_CONFIG_FILE, FLOWMSG, logger
+from .http_cache import make_etag, compress_variants
+from .preview_cache import response_cache, MISSING
+
+ARTIFACT_FORMAT = 1
+WORKFLOW_FILENAME = "wf.json"
+
+class InvalidArtifact(Exception):
+    pass
+
+_extension_index: Tuple[Optional[int], Dict[str, List[Dict[str, str]]]] = (None, {})
+_extension_lock = threading.Lock()
+
+def get_extension_index() -> Dict[str, List[Dict[str, str]]]:
+    global _extension_index
+    try:
+        mtime = EXTENSION_NODE_MAP_PATH.stat().st_mtime_ns
+    except OSError:
+        return {}
+    with _extension_lock:
+        if _extension_index[0] == mtime:
+            return _extension_index[1]
+        try:
+            with EXTENSION_NODE_MAP_PATH.open('r', encoding='utf-8') as f:
+                extension_node_map = json.load(f)
+        except Exception as e:
+            logger.error(f"{FLOWMSG}: Could not read {EXTENSION_NODE_MAP_PATH}: {e}")
+            return {}
+        index: Dict[str, List[Dict[str, str]]] = {}
+        for package_url, package_info in extension_node_map.items():
+            node_classes, extra_info = package_info[0], package_info[1] if len(package_info) > 1 else {}
+            package = {"title": extra_info.get("title_aux", package_url), "packageUrl": package_url}
+            for node_class in node_classes:
+                index.setdefault(node_class, []).append(package)
+        _extension_index = (mtime, index)
+        return index
+
+def get_registered_node_types() -> Optional[set]:
+    try:
+        import nodes
+    except ImportError:
+        return None
+    return set(nodes.NODE_CLASS_MAPPINGS)
+
+def stat_signature(flow_dir: Path) -> Optional[Tuple[int, int, int, int]]:
+    try:
+        wf = (flow_dir / WORKFLOW_FILENAME).stat()
+        conf = (flow_dir / FLOWS_CONFIG_FILE).stat()
+    except OSError:
+        return None
+    return wf.st_mtime_ns, wf.st_size, conf.st_mtime_ns, conf.st_size
+
+def compile_artifact(workflow: Dict[str, Any], flow_config: Dict[str, Any]) -> Dict[str, Any]:
+    node_types: Dict[str, int] = {}
+    for node in workflow.values():
+        if isinstance(node, dict) and node.get("class_type"):
+            node_types[node["class_type"]] = node_types.get(node["class_type"], 0) + 1
+
+    extension_index = get_extension_index()
+    registered = get_registered_node_types()
+    custom_packages: Dict[str, Dict[str, str]] = {}
+    missing_packages: Dict[str, Dict[str, str]] = {}
+    missing_nodes = []
+    for node_type in node_types:
+        packages = extension_index.get(node_type, [])
+        for package in packages:
+            custom_packages.setdefault(package["packageUrl"], package)
+        if registered is not None and node_type not in registered:
+            missing_nodes.append(node_type)
+            for package in packages:
+                missing_packages.setdefault(package["packageUrl"], package)
+
+    return {
+        "format": ARTIFACT_FORMAT,
+        "config": flow_config,
+        "workflow": workflow,
+        "nodeTypes": node_types,
+        "customPackages": list(custom_packages.values()),
+        "missingNodes": missing_nodes if registered is not None else None,
+        "missingCustomPackages": list(missing_packages.values()) if registered is not None else None,
+    }
+
+def parse_json_object(data: bytes, filename: str) -> Dict[str, Any]:
+    try:
+        parsed = json.loads(data)
+    except ValueError as e:
+        raise InvalidArtifact(f"{filename} is not valid JSON: {e}")
+    if not isinstance(parsed, dict):
+        raise InvalidArtifact(f"{filename} must contain a JSON object")
+    return parsed
+
+def load_flow_artifact(flow_id: str, flow_dir: Path) -> Optional[Dict[str, Any]]:
+    signature = stat_signature(flow_dir)
+    if signature is None:
+        return None
+    key = ("artifact", flow_id)
+    cached = response_cache.get(key)
+    if cached is not MISSING and cached["signature"] == signature:
+        if "error" in cached:
+            raise InvalidArtifact(cached["error"])
+        return cached
+
+    wf_bytes = (flow_dir / WORKFLOW_FILENAME).read_bytes()
+    conf_bytes = (flow_dir / FLOWS_CONFIG_FILE).read_bytes()
+    content_hash = hashlib.sha1(wf_bytes + b"\0" + conf_bytes).hexdigest()[:20]
+    if cached is not MISSING and cached["hash"] == content_hash and "error" not in cached:
+        # Touched but unchanged, e.g. rewritten with the same content.
+        entry = dict(cached, signature=signature)
+    else:
+        try:
+            artifact = compile_artifact(parse_json_object(wf_bytes, WORKFLOW_FILENAME), parse_json_object(conf_bytes, FLOWS_CONFIG_FILE))
+        except InvalidArtifact as e:
+            logger.warning(f"{FLOWMSG}: Flow '{flow_id}' has an invalid workflow: {e}")
+            response_cache.put(key, {"signature": signature, "hash": content_hash, "error": str(e)}, len(str(e)) + 256)
+            raise
+        body = json.dumps(artifact, separators=(",", ":")).encode("utf-8")
+        entry = {
+            "signature": signature,
+            "hash": content_hash,
+            "etag": make_etag(content_hash, str(ARTIFACT_FORMAT)),
+            "variants": compress_variants(body),
+        }
+    response_cache.put(key, entry, sum(len(v) for v in entry["variants"].values()))
+    return entry
+
+def invalidate_flow_artifact(flow_id: str) -> None:
+    response_cache.invalidate(("artifact", flow_id))
@@ -0,0 +1,100 @@
+import os
+import time
+import asyncio
+import hashlib
+from pathlib import Path
+from typing import Any, Dict, Optional
+from .constants import DATA_DIR, FLOWMSG, logger
+from .flow_storage import flow_lock
+
+FLOW_BLOBS_DIR = DATA_DIR / "flow_blobs"
+FLOW_BLOB_MIN_BYTES = 512
+HASH_CHUNK_SIZE = 1024 * 1024
+# Linked files share one inode with the blob and every other flow holding the same content,
+# so an in-place write would change them all. They are made read-only; anything writing into
+# a flow folder has to replace the whole file (write a temp file and rename it, or unlink first).
+FLOW_BLOB_FILE_MODE = 0o444
+
+def hash_file(path: Path) -> str:
+    h = hashlib.sha256()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def get_flow_blob_path(digest: str) -> Path:
+    return FLOW_BLOBS_DIR / digest[:2] / digest
+
+def new_report() -> Dict[str, Any]:
+    return {"flows": 0, "files": 0, "linked": 0, "bytesSaved": 0, "blobsRemoved": 0, "errors": 0}
+
+def link_file(path: Path, report: Dict[str, Any]) -> None:
+    st = path.lstat()
+    if not path.is_file() or path.is_symlink() or st.st_size < FLOW_BLOB_MIN_BYTES:
+        return
+    report["files"] += 1
+    blob = get_flow_blob_path(hash_file(path))
+    try:
+        blob_st = blob.stat()
+    except FileNotFoundError:
+        blob.parent.mkdir(parents=True, exist_ok=True)
+        os.link(path, blob)
+        os.chmod(blob, FLOW_BLOB_FILE_MODE)
+        return
+    if blob_st.st_mode & 0o777 != FLOW_BLOB_FILE_MODE:
+        os.chmod(blob, FLOW_BLOB_FILE_MODE)
+    if (blob_st.st_dev, blob_st.st_ino) == (st.st_dev, st.st_ino):
+        return
+    # Swap the copy for a hard link to the stored blob in one rename.
+    tmp = path.with_name(f".{path.name}.link")
+    tmp.unlink(missing_ok=True)
+    os.link(blob, tmp)
+    os.replace(tmp, path)
+    report["linked"] += 1
+    report["bytesSaved"] += st.st_size
+
+def compact_flow_folder(flow_dir: Path, report: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    report = report if report is not None else new_report()
+    report["flows"] += 1
+    for root, dirs, files in os.walk(flow_dir):
+        dirs[:] = [d for d in dirs if not d.startswith('.')]
+        for name in files:
+            if name.startswith('.'):
+                continue
+            try:
+                link_file(Path(root) / name, report)
+            except OSError as e:
+                # Hard links are not available everywhere (e.g. across devices); leave the copy alone.
+                report["errors"] += 1
+                logger.debug(f"{FLOWMSG}: Could not link {Path(root) / name} into the blob store: {e}")
+    return report
+
+def remove_unreferenced_blobs(report: Dict[str, Any]) -> None:
+    if not FLOW_BLOBS_DIR.is_dir():
+        return
+    for shard in FLOW_BLOBS_DIR.iterdir():
+        if not shard.is_dir():
+            continue
+        for blob in shard.iterdir():
+            # A link count of one means no flow folder points at the blob any more.
+            if blob.stat().st_nlink <= 1:
+                blob.unlink(missing_ok=True)
+                report["blobsRemoved"] += 1
+
+async def compact_flow(flow_dir: Path) -> Dict[str, Any]:
+    async with flow_lock(flow_dir):
+        return await asyncio.get_running_loop().run_in_executor(None, compact_flow_folder, flow_dir)
+
+async def compact_flows(flows_dir: Path) -> Dict[str, Any]:
+    started = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    report = new_report()
+    flow_dirs = [d for d in flows_dir.iterdir() if d.is_dir() and not d.name.startswith('.')] if flows_dir.is_dir() else []
+    for flow_dir in flow_dirs:
+        async with flow_lock(flow_dir):
+            await loop.run_in_executor(None, compact_flow_folder, flow_dir, report)
+    await loop.run_in_executor(None, remove_unreferenced_blobs, report)
+    report["durationMs"] = round((time.perf_counter() - started) * 1000, 1)
+    if report["linked"]:
+        logger.info(f"{FLOWMSG}: Flow compaction linked {report['linked']} files, saving {report['bytesSaved']} bytes")
+    return report
@@ -0,0 +1,230 @@
+import os
+import time
+import shutil
+import asyncio
+import tarfile
+import zipfile
+import tempfile
+import threading
+import concurrent.futures
+from pathlib import Path, PurePosixPath
+from typing import Any, IO, Iterable, Iterator, List, Optional, Tuple
+from aiohttp import web
+from .constants import FLOWS_CONFIG_FILE, FLOWS_PATH, SAFE_FOLDER_NAME_REGEX, FLOWMSG, logger
+from .flow_storage import CREATING_PREFIX
+from .flow_catalog import flow_catalog, load_flow_config
+from .uploads import STALE_UPLOAD_SECONDS
+
+BUNDLE_FORMATS = {
+    "zip": ("application/zip", "zip"),
+    "tar": ("application/x-tar", "tar"),
+    "tar.gz": ("application/gzip", "tar.gz"),
+}
+BUNDLE_QUEUE_DEPTH = 8
+IMPORTING_PREFIX = ".importing-"
+
+class InvalidBundle(Exception):
+    pass
+
+class BundleCancelled(Exception):
+    pass
+
+class BundleStream:
+    # Runs tarfile/zipfile in a worker thread and hands the bytes to the event loop
+    # through a bounded queue, so the archive is never held in memory as a whole.
+    def __init__(self, flow_dirs: List[Path], fmt: str):
+        self._flow_dirs = flow_dirs
+        self._fmt = fmt
+        self._queue: "asyncio.Queue[Any]" = asyncio.Queue(maxsize=BUNDLE_QUEUE_DEPTH)
+        self._loop = asyncio.get_running_loop()
+        self._cancelled = threading.Event()
+        self._loop.run_in_executor(None, self._produce)
+
+    def _put(self, item: Any) -> None:
+        future = asyncio.run_coroutine_threadsafe(self._queue.put(item), self._loop)
+        while True:
+            if self._cancelled.is_set():
+                future.cancel()
+                raise BundleCancelled()
+            try:
+                future.result(timeout=0.5)
+                return
+            except concurrent.futures.TimeoutError:
+                continue
+
+    def write(self, data: bytes) -> int:
+        if data:
+            self._put(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def _produce(self) -> None:
+        try:
+            write_bundle(self, self._flow_dirs, self._fmt)
+            self._put(None)
+        except BundleCancelled:
+            pass
+        except BaseException as e:
+            try:
+                self._put(e)
+            except BundleCancelled:
+                pass
+
+    def close(self) -> None:
+        self._cancelled.set()
+
+    async def __aiter__(self):
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+
+def iter_flow_files(flow_dir: Path) -> Iterator[Tuple[Path, str]]:
+    for root, dirs, files in os.walk(flow_dir):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+        for name in sorted(files):
+            if name.startswith('.'):
+                continue
+            path = Path(root) / name
+            yield path, path.relative_to(flow_dir.parent).as_posix()
+
+def write_bundle(fileobj: IO[bytes], flow_dirs: Iterable[Path], fmt: str) -> None:
+    if fmt == "zip":
+        with zipfile.ZipFile(fileobj, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+            for flow_dir in flow_dirs:
+                for path, arcname in iter_flow_files(flow_dir):
+                    archive.write(path, arcname)
+    else:
+        mode = "w|gz" if fmt == "tar.gz" else "w|"
+        with tarfile.open(fileobj=fileobj, mode=mode) as archive:
+            for flow_dir in flow_dirs:
+                for path, arcname in iter_flow_files(flow_dir):
+                    info = archive.gettarinfo(str(path), arcname)
+                    # Flow folders share hard-linked blobs; store every file as a plain member.
+                    info.type, info.linkname, info.size = tarfile.REGTYPE, "", path.stat().st_size
+                    with path.open('rb') as f:
+                        archive.addfile(info, f)
+
+def _member_parts(name: str) -> Tuple[str, ...]:
+    path = PurePosixPath(name.replace('\\', '/'))
+    if path.is_absolute() or any(part in ('..', '') for part in path.parts) or ':' in path.parts[0]:
+        raise InvalidBundle(f"Unsafe path in bundle: '{name}'")
+    if len(path.parts) < 2:
+        raise InvalidBundle(f"Unexpected file at the bundle root: '{name}'")
+    if not SAFE_FOLDER_NAME_REGEX.match(path.parts[0]):
+        raise InvalidBundle(f"Invalid flow folder name in bundle: '{path.parts[0]}'")
+    return path.parts
+
+def _iter_members(archive_path: Path, max_bytes: int) -> Iterator[Tuple[Tuple[str, ...], IO[bytes]]]:
+    total = 0
+    if zipfile.is_zipfile(archive_path):
+        with zipfile.ZipFile(archive_path) as archive:
+            for info in archive.infolist():
+                if info.is_dir():
+                    continue
+                parts = _member_parts(info.filename)
+                total += info.file_size
+                if total > max_bytes:
+                    raise InvalidBundle(f"Bundle expands beyond the {max_bytes} byte limit")
+                with archive.open(info) as f:
+                    yield parts, f
+        return
+
+    try:
+        archive = tarfile.open(archive_path, mode="r:*")
+    except tarfile.TarError:
+        raise InvalidBundle("Bundle is neither a zip nor a tar archive")
+    with archive:
+        for member in archive:
+            if member.isdir():
+                continue
+            if not member.isfile():
+                raise InvalidBundle(f"Unsupported entry type in bundle: '{member.name}'")
+            parts = _member_parts(member.name)
+            total += member.size
+            if total > max_bytes:
+                raise InvalidBundle(f"Bundle expands beyond the {max_bytes} byte limit")
+            yield parts, archive.extractfile(member)
+
+def extract_bundle(archive_path: Path, flows_dir: Path, max_bytes: int) -> Tuple[Path, List[str]]:
+    staging = Path(tempfile.mkdtemp(dir=flows_dir, prefix=IMPORTING_PREFIX))
+    try:
+        for parts, source in _iter_members(archive_path, max_bytes):
+            target = staging.joinpath(*parts)
+            target.parent.mkdir(parents=True, exist_ok=True)
+            with target.open('wb') as f:
+                shutil.copyfileobj(source, f)
+
+        flows = sorted(p.name for p in staging.iterdir() if p.is_dir())
+        if not flows:
+            raise InvalidBundle("Bundle does not contain any flow folders")
+        for name in flows:
+            if not (staging / name / FLOWS_CONFIG_FILE).is_file():
+                raise InvalidBundle(f"Flow folder '{name}' in bundle has no {FLOWS_CONFIG_FILE}")
+        return staging, flows
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+def plan_import(staging: Path, flows: List[str], flows_dir: Path) -> List[Tuple[str, Optional[str], Path, bool]]:
+    # A flow whose url the catalog already serves goes into that folder, so an import never
+    # leaves two folders claiming one url; whatever is already at the target is a conflict.
+    plan, urls = [], set()
+    for name in flows:
+        conf = load_flow_config(staging / name / FLOWS_CONFIG_FILE)
+        url = conf.get('url') if isinstance(conf, dict) else None
+        if url in urls:
+            raise InvalidBundle(f"Flow url '{url}' appears more than once in the bundle")
+        if url:
+            urls.add(url)
+        entry = flow_catalog.get(url) if url else None
+        target = entry["dir"] if entry else flows_dir / name
+        plan.append((name, url, target, target.exists()))
+    return plan
+
+def install_staged_flow(staged: Path, flow_folder: Path, overwrite: bool) -> bool:
+    if flow_folder.exists():
+        if not overwrite:
+            return False
+        trash = Path(tempfile.mkdtemp(dir=flow_folder.parent, prefix=IMPORTING_PREFIX))
+        os.rename(flow_folder, trash / flow_folder.name)
+        os.rename(staged, flow_folder)
+        shutil.rmtree(trash, ignore_errors=True)
+    else:
+        os.rename(staged, flow_folder)
+    return True
+
+def remove_staging_leftovers(flows_dir: Path) -> int:
+    # Staging and trash folders are renamed away or removed when an import or create
+    # finishes, and upload temp files are moved or unlinked; any still here belong to
+    # a process that died mid-way.
+    if not flows_dir.is_dir():
+        return 0
+    removed = 0
+    now = time.time()
+    for entry in flows_dir.iterdir():
+        if entry.name.startswith((IMPORTING_PREFIX, CREATING_PREFIX)) and entry.is_dir():
+            shutil.rmtree(entry, ignore_errors=True)
+            removed += 1
+        elif entry.name.startswith(".upload-") and entry.name.endswith(".tmp"):
+            try:
+                if now - entry.stat().st_mtime > STALE_UPLOAD_SECONDS:
+                    entry.unlink()
+                    removed += 1
+            except FileNotFoundError:
+                pass
+    return removed
+
+async def sweep_staging_leftovers(app: web.Application) -> None:
+    try:
+        removed = await asyncio.get_running_loop().run_in_executor(None, remove_staging_leftovers, FLOWS_PATH)
+    except Exception as e:
+        logger.error(f"{FLOWMSG}: Could not remove leftover flow staging files: {e}")
+        return
+    if removed:
+        logger.info(f"{FLOWMSG}: Removed {removed} leftover flow staging folders and uploads")
@@ -0,0 +1,235 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from aiohttp import web
+from .constants import (
+    DATA_DIR, FLOWS_PATH, FLOWS_CONFIG_FILE, FLOW_CATALOG_POLL_INTERVAL, FLOWMSG, logger
+)
+from .http_cache import make_etag, compress_variants
+from .flow_storage import atomic_write_bytes
+
+MAX_ENCODED_PROJECTIONS = 32
+MANIFEST_VERSION = 1
+DISCOVERY_WORKERS = min(8, (os.cpu_count() or 1) * 2)
+
+def load_flow_config(conf_file: Path) -> Dict[str, Any]:
+    try:
+        with conf_file.open('r') as f:
+            return json.load(f)
+    except json.JSONDecodeError as e:
+        logger.error(f"{FLOWMSG}: Invalid JSON in {conf_file}: {e}")
+        return {}
+    except Exception as e:
+        logger.error(f"{FLOWMSG}: Error loading config from {conf_file}: {e}")
+        return {}
+
+class FlowCatalog:
+    def __init__(self, flows_dir: Path, manifest_path: Path):
+        self.flows_dir = flows_dir
+        self.manifest_path = manifest_path
+        self.version = 0
+        self.last_scan: Dict[str, Any] = {}
+        self._manifest_dirty = False
+        # Set while the flows library sync is rewriting folders, so the poller does not publish half of it.
+        self.paused = False
+        self._lock = threading.Lock()
+        # Replaced wholesale on every change so handlers can read them without the lock.
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._by_url: Dict[str, Dict[str, Any]] = {}
+        self._configs: List[Dict[str, Any]] = []
+        self._encoded: Dict[Optional[Tuple[str, ...]], Dict[str, Any]] = {}
+
+    def get(self, url: str) -> Optional[Dict[str, Any]]:
+        return self._by_url.get(url)
+
+    def configs(self) -> List[Dict[str, Any]]:
+        return self._configs
+
+    def flow_dirs(self) -> List[Path]:
+        return [entry["dir"] for entry in self._by_url.values()]
+
+    def peek_encoded(self, fields: Optional[Tuple[str, ...]] = None) -> Optional[Dict[str, Any]]:
+        return self._encoded.get(fields)
+
+    def encoded(self, fields: Optional[Tuple[str, ...]] = None) -> Dict[str, Any]:
+        encoded = self._encoded
+        entry = encoded.get(fields)
+        if entry is not None:
+            return entry
+
+        configs = self._configs
+        if fields is not None:
+            configs = [{k: conf[k] for k in fields if k in conf} for conf in configs]
+        body = json.dumps(configs, separators=(",", ":")).encode("utf-8")
+        entry = {
+            "etag": make_etag(hashlib.sha1(body).hexdigest()[:20]),
+            "variants": compress_variants(body),
+        }
+        if len(encoded) >= MAX_ENCODED_PROJECTIONS:
+            encoded.clear()
+        encoded[fields] = entry
+        return entry
+
+    def __len__(self) -> int:
+        return len(self._configs)
+
+    def _stat_config(self, flow_dir: Path) -> Optional[int]:
+        try:
+            return (flow_dir / FLOWS_CONFIG_FILE).stat().st_mtime_ns
+        except OSError:
+            return None
+
+    def _parse_entry(self, flow_dir: Path, mtime: int) -> Dict[str, Any]:
+        conf = load_flow_config(flow_dir / FLOWS_CONFIG_FILE)
+        url = conf.get('url')
+        if not url:
+            # Kept with its mtime so the poller does not re-read and re-report it every pass.
+            logger.warning(f"{FLOWMSG}: Missing 'url' in config for {flow_dir}")
+        return {"url": url, "dir": flow_dir, "config": conf, "mtime": mtime}
+
+    def _publish(self, entries: Dict[str, Dict[str, Any]]) -> None:
+        by_url = {}
+        names = [name for name in sorted(entries) if entries[name]["url"]]
+        for name in names:
+            entry = entries[name]
+            if entry["url"] in by_url:
+                logger.warning(f"{FLOWMSG}: Flow url '{entry['url']}' in {entry['dir']} is already used by {by_url[entry['url']]['dir']}")
+                continue
+            by_url[entry["url"]] = entry
+        self._entries = entries
+        self._by_url = by_url
+        self._configs = [entries[name]["config"] for name in names]
+        self._encoded = {}
+        self._manifest_dirty = True
+        self.version += 1
+
+    def refresh_flow(self, flow_dir: Path) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            previous = self._entries.get(flow_dir.name)
+            mtime = self._stat_config(flow_dir) if flow_dir.is_dir() else None
+            if mtime is None:
+                entry = None
+            elif previous is not None and previous["mtime"] == mtime:
+                return previous
+            else:
+                entry = self._parse_entry(flow_dir, mtime)
+            if entry is None and previous is None:
+                return None
+            entries = dict(self._entries)
+            if entry is None:
+                entries.pop(flow_dir.name, None)
+            else:
+                entries[flow_dir.name] = entry
+            self._publish(entries)
+            return entry
+
+    def scan(self) -> bool:
+        with self._lock:
+            started = time.perf_counter()
+            entries = {}
+            stale = []
+            if self.flows_dir.is_dir():
+                for flow_dir in self.flows_dir.iterdir():
+                    if not flow_dir.is_dir() or flow_dir.name.startswith('.'):
+                        continue
+                    mtime = self._stat_config(flow_dir)
+                    if mtime is None:
+                        continue
+                    previous = self._entries.get(flow_dir.name)
+                    if previous is not None and previous["mtime"] == mtime:
+                        entries[flow_dir.name] = previous
+                    else:
+                        stale.append((flow_dir, mtime))
+            stat_ms = (time.perf_counter() - started) * 1000
+
+            if len(stale) > 1:
+                with ThreadPoolExecutor(max_workers=min(DISCOVERY_WORKERS, len(stale))) as pool:
+                    parsed = list(pool.map(lambda item: self._parse_entry(*item), stale))
+            else:
+                parsed = [self._parse_entry(*item) for item in stale]
+            for entry in parsed:
+                entries[entry["dir"].name] = entry
+
+            changed = bool(parsed) or entries.keys() != self._entries.keys()
+            if changed:
+                self._publish(entries)
+            if self._manifest_dirty:
+                self._save_manifest()
+            self.last_scan = {
+                "flows": len(entries),
+                "parsed": len(parsed),
+                "statMs": round(stat_ms, 1),
+                "totalMs": round((time.perf_counter() - started) * 1000, 1),
+            }
+            return changed
+
+    def load_manifest(self) -> int:
+        try:
+            with self.manifest_path.open('r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            return 0
+        except Exception as e:
+            logger.warning(f"{FLOWMSG}: Ignoring unreadable flow manifest {self.manifest_path}: {e}")
+            return 0
+        if manifest.get("version") != MANIFEST_VERSION or manifest.get("flowsDir") != str(self.flows_dir):
+            return 0
+
+        entries = {}
+        for name, item in manifest.get("flows", {}).items():
+            conf = item.get("config", {})
+            entries[name] = {"url": conf.get('url'), "dir": self.flows_dir / name,
+                             "config": conf, "mtime": item.get("mtime")}
+        with self._lock:
+            self._publish(entries)
+            self._manifest_dirty = False
+        return len(entries)
+
+    def _save_manifest(self) -> None:
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "flowsDir": str(self.flows_dir),
+            "flows": {name: {"mtime": e["mtime"], "config": e["config"]} for name, e in self._entries.items()},
+        }
+        try:
+            self.manifest_path.parent.mkdir(parents=True, exist_ok=True)
+            atomic_write_bytes(self.manifest_path, json.dumps(manifest, separators=(",", ":")).encode('utf-8'))
+            self._manifest_dirty = False
+        except Exception as e:
+            logger.warning(f"{FLOWMSG}: Could not write flow manifest {self.manifest_path}: {e}")
+
+    def discover(self) -> Dict[str, Any]:
+        started = time.perf_counter()
+        cached = self.load_manifest()
+        manifest_ms = (time.perf_counter() - started) * 1000
+        self.scan()
+        return dict(self.last_scan, manifestEntries=cached, manifestMs=round(manifest_ms, 1))
+
+flow_catalog = FlowCatalog(FLOWS_PATH, DATA_DIR / "flows_manifest.json")
+
+async def _poll_loop() -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(FLOW_CATALOG_POLL_INTERVAL)
+        if flow_catalog.paused:
+            continue
+        try:
+            if await loop.run_in_executor(None, flow_catalog.scan):
+                logger.info(f"{FLOWMSG}: Flow catalog reloaded, {len(flow_catalog)} flows available")
+        except Exception as e:
+            logger.error(f"{FLOWMSG}: Flow catalog scan failed: {e}")
+
+async def start_flow_catalog_poller(app: web.Application) -> None:
+    if FLOW_CATALOG_POLL_INTERVAL > 0:
+        app["flow_catalog_poller"] = asyncio.get_running_loop().create_task(_poll_loop())
+
+async def stop_flow_catalog_poller(app: web.Application) -> None:
+    task = app.get("flow_catalog_poller")
+    if task is not None:
+        task.cancel()
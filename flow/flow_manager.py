@@ -1,22 +1,33 @@
-import json
-from pathlib import Path
+import time
 from aiohttp import web
-from typing import Dict, Any
 from .constants import (
-    FLOWS_PATH, CORE_PATH, LINKER_PATH, FLOW_PATH, APP_CONFIGS, FLOWMSG,FLOWS_CONFIG_FILE, logger
+    CORE_PATH, LINKER_PATH, FLOW_PATH, FLOWMSG, logger
 )
-from .route_manager import RouteManager
+from .route_manager import FlowStaticResource, make_static_handler
+from .flow_catalog import flow_catalog, start_flow_catalog_poller, stop_flow_catalog_poller
 from .api_handlers import (
-    list_themes_handler, get_theme_css_handler, flow_version_handler,
-    apps_handler, extension_node_map_handler,
+    list_themes_handler, get_theme_css_handler, theme_index_handler, combined_themes_handler, flow_version_handler,
+    apps_handler, extension_node_map_handler, flow_artifact_handler, asset_manifest_handler,
+    sync_status_handler,
     install_package_handler, update_package_handler, uninstall_package_handler,
     installed_custom_nodes_handler, preview_flow_handler,
     reset_preview_handler, create_flow_handler, update_flow_handler, delete_flow_handler,
+    export_flow_handler, import_flow_handler, compact_flows_handler,
     set_model_preview_handler,
     clear_model_preview_handler,
     list_model_previews_handler,
-    get_model_preview_handler
+    get_model_preview_handler,
+    model_preview_thumbnail_handler,
+    flow_stats_handler,
+    model_previews_atlas_handler,
+    model_previews_atlas_image_handler,
+    model_previews_maintenance_handler
 )
+from .preview_maintenance import start_preview_maintenance, stop_preview_maintenance
+from .asset_manifest import asset_manifest, versioned_asset_handler
+from .static_assets import start_static_precompression, stop_static_precompression
+from .downloader import start_flows_sync, stop_flows_sync
+from .flow_bundles import sweep_staging_leftovers
 
 class FlowManager:
     @staticmethod
@@ -27,55 +38,77 @@ class FlowManager:
             FlowManager._setup_core_routes(app)
             
             FlowManager._setup_api_routes(app)
-            
-            FlowManager._setup_additional_routes(app)
+
+            app.on_startup.append(start_flow_catalog_poller)
+            app.on_cleanup.append(stop_flow_catalog_poller)
+            app.on_startup.append(start_preview_maintenance)
+            app.on_cleanup.append(stop_preview_maintenance)
+            app.on_startup.append(start_static_precompression)
+            app.on_cleanup.append(stop_static_precompression)
+            app.on_startup.append(sweep_staging_leftovers)
+            app.on_startup.append(start_flows_sync)
+            app.on_cleanup.append(stop_flows_sync)
 
         except Exception as e:
             logger.error(f"{FLOWMSG}: Failed to set up routes: {e}")
 
     @staticmethod
     def _setup_flows_routes(app: web.Application) -> None:
-        for flow_dir in filter(lambda d: d.is_dir(), FLOWS_PATH.iterdir()):
-            conf_file = flow_dir / FLOWS_CONFIG_FILE
-            if not conf_file.is_file():
-                # logger.warning(f"{FLOWMSG}: Config file not found in {flow_dir}")
-                continue
-                
-            conf = FlowManager._load_config(conf_file)
-            flow_url = conf.get('url')
-            if not flow_url:
-                logger.warning(f"{FLOWMSG}: Missing 'url' in config for {flow_dir}")
-                continue
-                
-            app.add_routes(RouteManager.create_routes(f"flow/{flow_url}", flow_dir))
-            APP_CONFIGS.append(conf)
+        started = time.perf_counter()
+        timings = flow_catalog.discover()
+        app.router.register_resource(
+            FlowStaticResource('/flow', flow_catalog, FLOW_PATH, {'linker': LINKER_PATH})
+        )
+        logger.info(
+            f"{FLOWMSG}: {len(flow_catalog)} flows ready in {(time.perf_counter() - started) * 1000:.1f} ms "
+            f"(manifest {timings['manifestEntries']} entries {timings['manifestMs']} ms, "
+            f"stat {timings['flows']} folders {timings['statMs']} ms, "
+            f"parsed {timings['parsed']} configs, scan {timings['totalMs']} ms)"
+        )
 
     @staticmethod
     def _setup_core_routes(app: web.Application) -> None:
         if CORE_PATH.is_dir():
             app.router.add_get('/core/css/themes/list', list_themes_handler)
             app.router.add_get('/core/css/themes/{filename}', get_theme_css_handler)
-            app.router.add_static('/core/', path=CORE_PATH, name='core')
+            asset_manifest.refresh()
+            app.router.add_get('/core/@{build}/{filename:.+}', versioned_asset_handler)
+            app.router.add_get('/core/{filename:.+}', make_static_handler(CORE_PATH), name='core')
 
     @staticmethod
     def _setup_api_routes(app: web.Application) -> None:
         api_routes = [
             (f'/flow/api/apps', 'GET', apps_handler),
             (f'/flow/api/extension-node-map', 'GET', extension_node_map_handler),
+            (f'/flow/api/flow-artifact', 'GET', flow_artifact_handler),
             (f'/flow/api/install-package', 'POST', install_package_handler),
             (f'/flow/api/update-package', 'POST', update_package_handler),
             (f'/flow/api/uninstall-package', 'POST', uninstall_package_handler),
             (f'/flow/api/flow-version', 'GET', flow_version_handler),
+            (f'/flow/api/asset-manifest', 'GET', asset_manifest_handler),
+            (f'/flow/api/themes', 'GET', theme_index_handler),
+            (f'/flow/api/themes/combined.css', 'GET', combined_themes_handler),
+            (f'/flow/api/stats', 'GET', flow_stats_handler),
+            (f'/flow/api/sync-status', 'GET', sync_status_handler),
             (f'/flow/api/installed-custom-nodes', 'GET', installed_custom_nodes_handler),
             (f'/flow/api/preview-flow', 'POST', preview_flow_handler),
             (f'/flow/api/reset-preview', 'POST', reset_preview_handler),
             (f'/flow/api/create-flow', 'POST', create_flow_handler),
             (f'/flow/api/update-flow', 'POST', update_flow_handler),
             (f'/flow/api/delete-flow', 'DELETE', delete_flow_handler),
+            (f'/flow/api/export-flow', 'GET', export_flow_handler),
+            (f'/flow/api/import-flow', 'POST', import_flow_handler),
+            (f'/flow/api/compact-flows', 'POST', compact_flows_handler),
             (f'/flow/api/model-preview', 'POST', set_model_preview_handler),
             (f'/flow/api/model-preview', 'DELETE', clear_model_preview_handler),
             (f'/flow/api/model-previews', 'POST', list_model_previews_handler),
+            (f'/flow/api/model-previews', 'GET', list_model_previews_handler),
             (f'/flow/api/model-preview', 'GET', get_model_preview_handler),
+            (f'/flow/api/model-preview/{{previewId}}/thumbnail', 'GET', model_preview_thumbnail_handler),
+            (f'/flow/api/model-previews/atlas', 'POST', model_previews_atlas_handler),
+            (f'/flow/api/model-previews/atlas/{{atlasId}}', 'GET', model_previews_atlas_image_handler),
+            (f'/flow/api/model-previews/maintenance', 'POST', model_previews_maintenance_handler),
+            (f'/flow/api/model-previews/maintenance', 'GET', model_previews_maintenance_handler),
         ]
 
         for path, method, handler in api_routes:
@@ -85,24 +118,3 @@ class FlowManager:
                 app.router.add_post(path, handler)
             elif method == 'DELETE':
                 app.router.add_delete(path, handler)
-
-    @staticmethod
-    def _setup_additional_routes(app: web.Application) -> None:
-        if LINKER_PATH.is_dir():
-            app.add_routes(RouteManager.create_routes('flow/linker', LINKER_PATH))
-        if FLOW_PATH.is_dir():
-            app.add_routes(RouteManager.create_routes('flow', FLOW_PATH))
-
-    @staticmethod
-    def _load_config(conf_file: Path) -> Dict[str, Any]:
-        try:
-            with conf_file.open('r') as f:
-                return json.load(f)
-        except json.JSONDecodeError as e:
-            logger.error(f"{FLOWMSG}: Invalid JSON in {conf_file}: {e}")
-            return {}
-        except Exception as e:
-            logger.error(f"{FLOWMSG}: Error loading config from {conf_file}: {e}")
-            return {}
-        
-        
\ No newline at end of file
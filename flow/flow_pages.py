@@ -0,0 +1,96 @@
+import re
+import html
+import json
+import hashlib
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from .constants import FLOW_PAGE_INLINE_MAX_BYTES
+from .asset_manifest import AssetManifest, get_asset_manifest
+from .flow_artifacts import InvalidArtifact, load_flow_artifact, stat_signature
+from .http_cache import make_etag, compress_variants
+from .preview_cache import response_cache, MISSING
+
+ARTIFACT_ELEMENT_ID = "flow-artifact"
+CORE_SCRIPTS_MODULE = "js/common/scripts/corePath.js"
+APP_SCRIPTS = ("/core/main.js",)
+CORE_SCRIPT_REGEX = re.compile(r"['\"](/core/[^'\"]+\.js)['\"]")
+EMPTY_TITLE_REGEX = re.compile(rb"<title>\s*</title>", re.I)
+HEAD_END_REGEX = re.compile(rb"</head>", re.I)
+
+def get_page_script_entries(manifest: AssetManifest) -> Optional[List[str]]:
+    # Mirrors the list loadScripts.js builds: the core scripts from corePath.js, then main.js.
+    if CORE_SCRIPTS_MODULE not in manifest.assets:
+        return None
+    source = (manifest.root / CORE_SCRIPTS_MODULE).read_text(encoding="utf-8")
+    scripts = CORE_SCRIPT_REGEX.findall(source) + list(APP_SCRIPTS)
+    return [manifest.url_for(src[len("/core/"):]) for src in scripts]
+
+def get_preload_links(manifest: AssetManifest, flow_id: str, inlined: bool, scripts: bool) -> List[str]:
+    links = []
+    if "css/main.css" in manifest.assets:
+        links.append(f"<{manifest.url_for('css/main.css')}>; rel=preload; as=style")
+    if "content.html" in manifest.assets:
+        links.append(f"<{manifest.url_for('content.html')}>; rel=preload; as=fetch; crossorigin")
+    if scripts and "loadScripts.js" in manifest.assets:
+        links.append(f"<{manifest.url_for('loadScripts.js')}>; rel=modulepreload")
+        # The same fingerprinted URLs loadScripts.js requests, so the browser reuses the preloaded modules.
+        for entry in get_page_script_entries(manifest) or ():
+            links.append(f"<{entry}>; rel=modulepreload")
+    if not inlined:
+        links.append(f"</flow/api/flow-artifact?url={flow_id}>; rel=preload; as=fetch; crossorigin")
+    links.append("</flow/api/themes>; rel=preload; as=fetch; crossorigin")
+    return links
+
+def encode_inline_json(data: bytes) -> bytes:
+    # '<' only appears inside JSON strings, so escaping it keeps </script> and <!-- out of the block.
+    return data.replace(b"<", b"\\u003c")
+
+def render_flow_page(flow_id: str, flow_dir: Path, page_path: Path) -> Dict[str, Any]:
+    manifest = get_asset_manifest()
+    broken = False
+    try:
+        artifact = load_flow_artifact(flow_id, flow_dir)
+    except InvalidArtifact:
+        # Serve the page as a plain file would be; it reports the broken workflow itself.
+        artifact = None
+        broken = True
+    st = page_path.stat()
+    key = (
+        "flow-render", flow_id, manifest.build, st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size,
+        artifact["hash"] if artifact else stat_signature(flow_dir) if broken else None,
+    )
+    cached = response_cache.get(key)
+    if cached is not MISSING:
+        return cached
+
+    page = page_path.read_bytes()
+    # Pages that load the app some other way (the linker) would only waste the module preloads.
+    scripts = b"/loadScripts.js" in page
+    if manifest.build:
+        page = manifest.rewrite(page)
+
+    inlined = False
+    if artifact is not None:
+        body = artifact["variants"]["identity"]
+        parsed = json.loads(body)
+        if len(body) <= FLOW_PAGE_INLINE_MAX_BYTES:
+            inlined = True
+        else:
+            # Too big to hold up first paint; the page gets the config and fetches the workflow.
+            body = json.dumps({"format": parsed["format"], "config": parsed["config"], "workflow": None}).encode("utf-8")
+        block = (
+            f'<script type="application/json" id="{ARTIFACT_ELEMENT_ID}" data-flow="{html.escape(flow_id)}">'.encode("utf-8")
+            + encode_inline_json(body) + b"</script>\n"
+        )
+        name = parsed["config"].get("name") if isinstance(parsed.get("config"), dict) else None
+        if name:
+            page = EMPTY_TITLE_REGEX.sub(lambda _: f"<title>{html.escape(str(name))}</title>".encode("utf-8"), page, count=1)
+        page = HEAD_END_REGEX.sub(lambda m: block + m.group(0), page, count=1)
+
+    cached = {
+        "etag": make_etag(hashlib.sha1(repr(key).encode("utf-8")).hexdigest()[:20]),
+        "variants": compress_variants(page),
+        "links": "" if broken else ", ".join(get_preload_links(manifest, flow_id, inlined, scripts)),
+    }
+    response_cache.put(key, cached, sum(len(v) for v in cached["variants"].values()))
+    return cached
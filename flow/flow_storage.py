@@ -0,0 +1,118 @@
+import os
+import json
+import stat
+import shutil
+import asyncio
+import tempfile
+import weakref
+from pathlib import Path
+from typing import Any, Dict, NamedTuple, Union
+
+CREATING_PREFIX = ".creating-"
+
+_flow_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+def flow_lock(flow_folder: Path) -> asyncio.Lock:
+    key = str(flow_folder)
+    lock = _flow_locks.get(key)
+    if lock is None:
+        lock = asyncio.Lock()
+        _flow_locks[key] = lock
+    return lock
+
+def _read_umask() -> int:
+    # os.umask can only be read by setting it; done once at import, before any worker threads exist.
+    mask = os.umask(0)
+    os.umask(mask)
+    return mask
+
+# What open() would have created; mkstemp always uses 0600.
+DEFAULT_FILE_MODE = 0o666 & ~_read_umask()
+
+def encode_json(data: Any) -> bytes:
+    return json.dumps(data, indent=2).encode('utf-8')
+
+def atomic_write_bytes(path: Path, data: bytes) -> None:
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_name, DEFAULT_FILE_MODE)
+        os.replace(tmp_name, path)
+    except BaseException:
+        Path(tmp_name).unlink(missing_ok=True)
+        raise
+
+def atomic_copy_file(source: Path, path: Path) -> None:
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as f, source.open('rb') as src:
+            shutil.copyfileobj(src, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_name, DEFAULT_FILE_MODE)
+        os.replace(tmp_name, path)
+    except BaseException:
+        Path(tmp_name).unlink(missing_ok=True)
+        raise
+
+def _make_replaceable(path: Path) -> None:
+    # Files linked into the blob store are read-only (see flow_blobs), which only
+    # stops Windows from renaming over or deleting them.
+    if os.name == 'nt' and path.is_file() and not os.access(path, os.W_OK):
+        os.chmod(path, stat.S_IREAD | stat.S_IWRITE)
+
+def _remove_readonly(func, path, excinfo) -> None:
+    os.chmod(path, stat.S_IWRITE)
+    func(path)
+
+class FileCopy(NamedTuple):
+    # A file that has to stay where it is (templates, defaults); copied instead of moved.
+    source: Path
+
+FileContent = Union[bytes, Path, FileCopy]
+
+def _write_files(folder: Path, files: Dict[str, FileContent]) -> None:
+    for relative, data in files.items():
+        path = folder / relative
+        path.parent.mkdir(parents=True, exist_ok=True)
+        _make_replaceable(path)
+        if isinstance(data, FileCopy):
+            atomic_copy_file(data.source, path)
+        elif isinstance(data, Path):
+            # Already fsynced temp files (streamed uploads) are moved into place as they are.
+            shutil.move(str(data), str(path))
+        else:
+            atomic_write_bytes(path, data)
+
+def _create_flow(flow_folder: Path, files: Dict[str, FileContent]) -> None:
+    if flow_folder.exists():
+        raise FileExistsError(flow_folder)
+    # Build the flow next to its final location and rename it in one step so
+    # the catalog poller never sees a half-written folder.
+    staging = Path(tempfile.mkdtemp(dir=flow_folder.parent, prefix=f"{CREATING_PREFIX}{flow_folder.name}-"))
+    try:
+        _write_files(staging, files)
+        os.rename(staging, flow_folder)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+async def write_flow_files(flow_folder: Path, files: Dict[str, FileContent], create: bool = False) -> None:
+    loop = asyncio.get_running_loop()
+    async with flow_lock(flow_folder):
+        if create:
+            await loop.run_in_executor(None, _create_flow, flow_folder, files)
+        else:
+            await loop.run_in_executor(None, _write_files, flow_folder, files)
+
+async def copy_flow_files(flow_folder: Path, copies: Dict[str, Path]) -> None:
+    await write_flow_files(flow_folder, {relative: FileCopy(source) for relative, source in copies.items()})
+
+async def delete_flow_folder(flow_folder: Path) -> None:
+    async with flow_lock(flow_folder):
+        await asyncio.get_running_loop().run_in_executor(
+            None, lambda: shutil.rmtree(flow_folder, onerror=_remove_readonly)
+        )
@@ -0,0 +1,103 @@
+import gzip
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Optional, Dict
+from aiohttp import web
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+COMPRESS_MIN_BYTES = 1024
+ENCODING_PREFERENCE = ("br", "gzip")
+
+def http_date(timestamp: float) -> str:
+    return formatdate(timestamp, usegmt=True)
+
+def make_etag(*parts: str) -> str:
+    return '"' + "-".join(parts) + '"'
+
+def is_not_modified(request: web.Request, etag: str, last_modified: Optional[float] = None) -> bool:
+    if_none_match = request.headers.get("If-None-Match")
+    if if_none_match is not None:
+        candidates = [tag.strip() for tag in if_none_match.split(",")]
+        weak_etag = f"W/{etag}"
+        return "*" in candidates or etag in candidates or weak_etag in candidates
+
+    if_modified_since = request.headers.get("If-Modified-Since")
+    if if_modified_since and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return int(last_modified) <= int(since)
+
+    return False
+
+def cache_headers(etag: str, last_modified: Optional[float] = None,
+                  cache_control: str = REVALIDATE_CACHE_CONTROL) -> Dict[str, str]:
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if last_modified is not None:
+        headers["Last-Modified"] = http_date(last_modified)
+    return headers
+
+def conditional_response(request: web.Request, body: bytes, content_type: str, etag: str,
+                         last_modified: Optional[float] = None,
+                         cache_control: str = REVALIDATE_CACHE_CONTROL,
+                         extra_headers: Optional[Dict[str, str]] = None) -> web.Response:
+    headers = cache_headers(etag, last_modified, cache_control)
+    if extra_headers:
+        headers.update(extra_headers)
+    if is_not_modified(request, etag, last_modified):
+        return web.Response(status=304, headers=headers)
+    return web.Response(body=body, content_type=content_type, headers=headers)
+
+def compress_variants(body: bytes) -> Dict[str, bytes]:
+    variants = {"identity": body}
+    if len(body) < COMPRESS_MIN_BYTES:
+        return variants
+    compressed = {"gzip": gzip.compress(body, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        compressed["br"] = brotli.compress(body, quality=11)
+    for encoding, data in compressed.items():
+        if len(data) < len(body):
+            variants[encoding] = data
+    return variants
+
+def accepted_encodings(request: web.Request) -> Dict[str, float]:
+    accepted = {}
+    for item in request.headers.get("Accept-Encoding", "").split(","):
+        coding, _, params = item.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if coding:
+            accepted[coding.lower()] = q
+    return accepted
+
+def pick_encoding(request: web.Request, variants: Dict[str, bytes]) -> str:
+    accepted = accepted_encodings(request)
+    for encoding in ENCODING_PREFERENCE:
+        if encoding in variants and accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return "identity"
+
+def variant_response(request: web.Request, variants: Dict[str, bytes], content_type: str, etag: str,
+                     cache_control: str = REVALIDATE_CACHE_CONTROL) -> web.Response:
+    encoding = pick_encoding(request, variants)
+    # Each encoding is a different representation, so it gets its own strong validator.
+    if encoding != "identity":
+        etag = f'{etag[:-1]}-{encoding}"'
+    headers = cache_headers(etag, cache_control=cache_control)
+    headers["Vary"] = "Accept-Encoding"
+    if is_not_modified(request, etag):
+        return web.Response(status=304, headers=headers)
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    return web.Response(body=variants[encoding], content_type=content_type, headers=headers)
@@ -0,0 +1,84 @@
+from io import BytesIO
+from typing import Dict, Optional, Tuple, Union
+from PIL import Image, features
+
+MODEL_PREVIEW_THUMBNAIL_WIDTH = 128
+FLOW_THUMBNAIL_WIDTH = 468
+PREVIEW_RENDITION_SIZES = (64, 128, 256, 512)
+RENDITION_FORMATS = {
+    "jpeg": ("JPEG", "jpg", "image/jpeg"),
+    "webp": ("WEBP", "webp", "image/webp"),
+}
+WEBP_AVAILABLE = features.check("webp")
+
+ImageSource = Union[bytes, str]
+
+def rendition_formats():
+    return [fmt for fmt in RENDITION_FORMATS if fmt != "webp" or WEBP_AVAILABLE]
+
+def sniff_image_mime(path: str) -> Optional[str]:
+    try:
+        with Image.open(path) as image:
+            return Image.MIME.get(image.format)
+    except OSError:
+        return None
+
+def open_for_width(source: ImageSource, width: int) -> Image.Image:
+    image = Image.open(BytesIO(source) if isinstance(source, bytes) else source)
+    if image.format == "JPEG" and image.size[0] > width:
+        # Let libjpeg decode at a reduced DCT scale instead of full resolution.
+        image.draft("RGB", (width, max(1, width * image.size[1] // image.size[0])))
+    image.load()
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    return image
+
+def resize_to_width(image: Image.Image, width: int) -> Image.Image:
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    width = min(width, image.size[0])
+    w_percent = width / float(image.size[0])
+    h_new = max(1, int(float(image.size[1]) * w_percent))
+    return image.resize((width, h_new), Image.Resampling.LANCZOS)
+
+def encode_image(image: Image.Image, fmt: str) -> bytes:
+    pil_format = RENDITION_FORMATS[fmt][0]
+    buffered = BytesIO()
+    if pil_format == "WEBP":
+        image.save(buffered, format=pil_format, quality=82, method=4)
+    else:
+        image.save(buffered, format=pil_format, quality=85, optimize=True)
+    return buffered.getvalue()
+
+def encode_jpeg_thumbnail(source: ImageSource, width: int) -> bytes:
+    image = open_for_width(source, width)
+    return encode_image(resize_to_width(image, width), "jpeg")
+
+def make_preview_renditions(source: ImageSource) -> Dict[Tuple[int, str], bytes]:
+    image = open_for_width(source, max(PREVIEW_RENDITION_SIZES))
+    renditions = {}
+    # Work down from the largest size so each step resamples an already reduced image.
+    for size in sorted(PREVIEW_RENDITION_SIZES, reverse=True):
+        image = resize_to_width(image, size)
+        for fmt in rendition_formats():
+            renditions[(size, fmt)] = encode_image(image, fmt)
+    return renditions
+
+def make_flow_thumbnail(source: ImageSource) -> bytes:
+    return encode_jpeg_thumbnail(source, FLOW_THUMBNAIL_WIDTH)
+
+def new_atlas_canvas(count: int, cell: int, columns: int) -> Image.Image:
+    rows = max(1, (count + columns - 1) // columns)
+    return Image.new("RGB", (min(count, columns) * cell or cell, rows * cell), (0, 0, 0))
+
+def paste_atlas_cell(canvas: Image.Image, index: int, cell: int, columns: int, source: bytes) -> Tuple[int, int, int, int]:
+    x0 = (index % columns) * cell
+    y0 = (index // columns) * cell
+    canvas.paste((0, 0, 0), (x0, y0, x0 + cell, y0 + cell))
+    with Image.open(BytesIO(source)) as image:
+        tile = image.convert("RGB")
+    tile.thumbnail((cell, cell), Image.Resampling.LANCZOS)
+    x = x0 + (cell - tile.size[0]) // 2
+    y = y0 + (cell - tile.size[1]) // 2
+    canvas.paste(tile, (x, y))
+    return x, y, tile.size[0], tile.size[1]
@@ -0,0 +1,124 @@
+import json
+import asyncio
+import hashlib
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+from .constants import DATA_DIR, FLOWMSG, logger
+from .http_cache import make_etag
+from .preview_cache import preview_cache, MISSING
+from .image_worker import image_pool
+from .image_processing import encode_image, new_atlas_canvas, paste_atlas_cell
+from .preview_store import load_registry_index, load_blob_rendition, pick_rendition_size
+from .flow_storage import atomic_write_bytes
+
+PREVIEWS_ATLAS_DIR = DATA_DIR / "model_preview_atlases"
+ATLAS_COLUMNS = 16
+ATLAS_MAX_ITEMS = 1024
+# Upper bound for the decoded RGB canvas a single atlas may need while it is rendered.
+ATLAS_MAX_CANVAS_BYTES = 32 * 1024 * 1024
+ATLAS_MAX_RECIPES = 256
+ATLAS_MAX_STORED_RECIPES = 4096
+
+_recipes: "OrderedDict[str, Tuple[Tuple[str, ...], int]]" = OrderedDict()
+_build_lock: Optional[asyncio.Lock] = None
+
+def atlas_max_items(cell: int) -> int:
+    row_bytes = ATLAS_COLUMNS * cell * cell * 3
+    return min(ATLAS_MAX_ITEMS, ATLAS_MAX_CANVAS_BYTES // row_bytes * ATLAS_COLUMNS)
+
+def get_atlas_id(pids: Tuple[str, ...], cell: int) -> str:
+    h = hashlib.sha1(f"{cell}:{','.join(pids)}".encode("utf-8"))
+    return h.hexdigest()[:16]
+
+def _remember_recipe(atlas_id: str, recipe: Tuple[Tuple[str, ...], int]) -> None:
+    _recipes[atlas_id] = recipe
+    _recipes.move_to_end(atlas_id)
+    while len(_recipes) > ATLAS_MAX_RECIPES:
+        _recipes.popitem(last=False)
+
+def _prune_stored_recipes() -> None:
+    stored = sorted(PREVIEWS_ATLAS_DIR.glob("*.json"), key=lambda p: p.stat().st_mtime)
+    for path in stored[:max(0, len(stored) - ATLAS_MAX_STORED_RECIPES)]:
+        path.unlink(missing_ok=True)
+
+def register_atlas(pids: List[str], cell: int) -> str:
+    key = tuple(sorted(set(pids)))
+    atlas_id = get_atlas_id(key, cell)
+    _remember_recipe(atlas_id, (key, cell))
+    # The id is derived from the recipe, so a copy on disk lets any later GET rebuild it,
+    # including after a restart or once the in-memory entry has been evicted.
+    path = PREVIEWS_ATLAS_DIR / f"{atlas_id}.json"
+    try:
+        if path.exists():
+            path.touch()
+        else:
+            PREVIEWS_ATLAS_DIR.mkdir(parents=True, exist_ok=True)
+            atomic_write_bytes(path, json.dumps({"cell": cell, "previewIds": list(key)}).encode("utf-8"))
+            _prune_stored_recipes()
+    except OSError as e:
+        logger.warning(f"{FLOWMSG}: Could not store atlas recipe {atlas_id}: {e}")
+    return atlas_id
+
+def load_atlas_recipe(atlas_id: str) -> Optional[Tuple[Tuple[str, ...], int]]:
+    recipe = _recipes.get(atlas_id)
+    if recipe is not None:
+        return recipe
+    try:
+        data = json.loads((PREVIEWS_ATLAS_DIR / f"{atlas_id}.json").read_bytes())
+        pids, cell = tuple(data["previewIds"]), int(data["cell"])
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        logger.warning(f"{FLOWMSG}: Ignoring unreadable atlas recipe {atlas_id}: {e}")
+        return None
+    # A recipe that does not hash back to its name was not written by register_atlas.
+    if get_atlas_id(pids, cell) != atlas_id or len(pids) > atlas_max_items(cell):
+        return None
+    _remember_recipe(atlas_id, (pids, cell))
+    return pids, cell
+
+def _render_atlas(pids: Tuple[str, ...], cell: int, versions: Dict[str, str],
+                  fmt: str) -> Tuple[Dict[str, Tuple[int, int, int, int]], int, int, bytes]:
+    # The canvas only lives for the duration of one build; the cache keeps the encoded bytes.
+    canvas = new_atlas_canvas(len(pids), cell, ATLAS_COLUMNS)
+    boxes = {}
+    size = pick_rendition_size(cell)
+    for index, pid in enumerate(pids):
+        rendition = load_blob_rendition(versions[pid], size, "jpeg")
+        if rendition:
+            boxes[pid] = paste_atlas_cell(canvas, index, cell, ATLAS_COLUMNS, rendition["data"])
+    width, height = canvas.size
+    return boxes, width, height, encode_image(canvas, fmt)
+
+async def build_atlas(atlas_id: str) -> Optional[Dict[str, Any]]:
+    global _build_lock
+    recipe = await asyncio.get_running_loop().run_in_executor(None, load_atlas_recipe, atlas_id)
+    if recipe is None:
+        return None
+    pids, cell = recipe
+
+    if _build_lock is None:
+        _build_lock = asyncio.Lock()
+    async with _build_lock:
+        index = load_registry_index()
+        versions = {pid: index[pid]["blobHash"] for pid in pids if pid in index}
+        key = ("atlas", atlas_id)
+        cached = preview_cache.get(key)
+        if cached is not MISSING and cached["versions"] == versions:
+            return cached
+
+        ordered = tuple(pid for pid in pids if pid in versions)
+        boxes, width, height, data = await image_pool.run(_render_atlas, ordered, cell, versions, "jpeg")
+        version = hashlib.sha1(",".join(versions[pid] for pid in ordered).encode("utf-8")).hexdigest()[:16]
+        entry = {
+            "atlasId": atlas_id,
+            "version": version,
+            "etag": make_etag(atlas_id, version),
+            "versions": versions,
+            "boxes": boxes,
+            "width": width,
+            "height": height,
+            "data": data,
+        }
+        preview_cache.put(key, entry, len(data))
+        return entry
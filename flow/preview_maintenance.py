@@ -0,0 +1,151 @@
+import time
+import asyncio
+import shutil
+from pathlib import Path
+from typing import Any, Dict, Optional, Set
+from aiohttp import web
+from .constants import (
+    FLOWMSG, logger, MODEL_PREVIEW_DISK_QUOTA_BYTES, PREVIEW_MAINTENANCE_INTERVAL,
+    PREVIEW_MAINTENANCE_REMOVE_ORPHANS
+)
+from .preview_store import (
+    PREVIEWS_BLOBS_DIR, get_preview_id, get_blob_folder, preview_registry,
+    flush_preview_access, remove_preview_blobs, invalidate_registry_cache, ensure_data_folders
+)
+from .uploads import STALE_UPLOAD_SECONDS
+
+_last_report: Optional[Dict[str, Any]] = None
+_maintenance_lock: Optional[asyncio.Lock] = None
+
+def get_known_preview_ids() -> Optional[Set[str]]:
+    try:
+        import folder_paths
+    except ImportError:
+        return None
+
+    known = set()
+    for folder_name in list(folder_paths.folder_names_and_paths.keys()):
+        try:
+            for filename in folder_paths.get_filename_list(folder_name):
+                known.add(get_preview_id(filename))
+        except Exception as e:
+            logger.warning(f"{FLOWMSG}: Could not list models in '{folder_name}': {e}")
+            return None
+    return known
+
+def folder_size(folder: Path) -> int:
+    return sum(p.stat().st_size for p in folder.rglob("*") if p.is_file())
+
+def remove_blobs(blob_hashes) -> int:
+    reclaimed = 0
+    for blob_hash in blob_hashes:
+        blob_folder = get_blob_folder(blob_hash)
+        if blob_folder.is_dir():
+            reclaimed += folder_size(blob_folder)
+    remove_preview_blobs(blob_hashes)
+    return reclaimed
+
+def sweep_stray_files(referenced: Set[str]) -> int:
+    reclaimed = 0
+    now = time.time()
+    for tmp in PREVIEWS_BLOBS_DIR.glob(".upload-*.tmp"):
+        st = tmp.stat()
+        if now - st.st_mtime > STALE_UPLOAD_SECONDS:
+            tmp.unlink(missing_ok=True)
+            reclaimed += st.st_size
+    for shard in PREVIEWS_BLOBS_DIR.iterdir():
+        if not shard.is_dir():
+            continue
+        for blob_folder in shard.iterdir():
+            if blob_folder.name in referenced:
+                continue
+            # Uploads write the blob before the registry records it; give them the same grace period.
+            try:
+                if now - blob_folder.stat().st_mtime <= STALE_UPLOAD_SECONDS:
+                    continue
+            except FileNotFoundError:
+                continue
+            reclaimed += folder_size(blob_folder)
+            shutil.rmtree(blob_folder, ignore_errors=True)
+    return reclaimed
+
+def run_preview_maintenance(quota_bytes: int = MODEL_PREVIEW_DISK_QUOTA_BYTES,
+                            remove_orphans: bool = False) -> Dict[str, Any]:
+    started = time.perf_counter()
+    ensure_data_folders()
+    flush_preview_access()
+    report = {"orphansFound": 0, "orphansRemoved": 0, "evicted": 0, "reclaimedBytes": 0, "quotaBytes": quota_bytes}
+
+    known = get_known_preview_ids()
+    entries = preview_registry.list_entries()
+    if known:
+        orphans = [entry["previewId"] for entry in entries if entry["previewId"] not in known]
+        report["orphansFound"] = len(orphans)
+    if known and remove_orphans:
+        removed, released = preview_registry.delete_many(orphans)
+        report["orphansRemoved"] = removed
+        report["reclaimedBytes"] += remove_blobs(released)
+        entries = [entry for entry in entries if entry["previewId"] in known]
+
+    report["reclaimedBytes"] += sweep_stray_files(preview_registry.blob_hashes())
+
+    blob_sizes = {}
+    for entry in entries:
+        blob_hash = entry["blobHash"]
+        if blob_hash and blob_hash not in blob_sizes:
+            blob_folder = get_blob_folder(blob_hash)
+            blob_sizes[blob_hash] = folder_size(blob_folder) if blob_folder.is_dir() else 0
+    total = sum(blob_sizes.values())
+
+    if quota_bytes > 0 and total > quota_bytes:
+        for entry in sorted(entries, key=lambda e: e["accessed"] or 0):
+            if total <= quota_bytes:
+                break
+            removed, released = preview_registry.delete_many([entry["previewId"]])
+            report["evicted"] += removed
+            freed = remove_blobs(released)
+            report["reclaimedBytes"] += freed
+            total -= freed
+
+    if report["orphansRemoved"] or report["evicted"]:
+        invalidate_registry_cache()
+        preview_registry.vacuum()
+
+    report["totalBytes"] = total
+    report["durationMs"] = round((time.perf_counter() - started) * 1000, 1)
+    report["finishedAt"] = time.time()
+    return report
+
+async def run_preview_maintenance_async(remove_orphans: bool = False) -> Dict[str, Any]:
+    global _last_report, _maintenance_lock
+    if _maintenance_lock is None:
+        _maintenance_lock = asyncio.Lock()
+    async with _maintenance_lock:
+        loop = asyncio.get_running_loop()
+        _last_report = await loop.run_in_executor(
+            None, lambda: run_preview_maintenance(remove_orphans=remove_orphans)
+        )
+    if _last_report["reclaimedBytes"]:
+        logger.info(f"{FLOWMSG}: Preview maintenance reclaimed {_last_report['reclaimedBytes']} bytes")
+    return _last_report
+
+def get_last_report() -> Optional[Dict[str, Any]]:
+    return _last_report
+
+async def _maintenance_loop() -> None:
+    while True:
+        await asyncio.sleep(PREVIEW_MAINTENANCE_INTERVAL)
+        try:
+            # Only quota eviction runs unattended unless orphan removal was opted into.
+            await run_preview_maintenance_async(PREVIEW_MAINTENANCE_REMOVE_ORPHANS)
+        except Exception as e:
+            logger.error(f"{FLOWMSG}: Preview maintenance failed: {e}")
+
+async def start_preview_maintenance(app: web.Application) -> None:
+    if PREVIEW_MAINTENANCE_INTERVAL > 0:
+        app["flow_preview_maintenance"] = asyncio.get_running_loop().create_task(_maintenance_loop())
+
+async def stop_preview_maintenance(app: web.Application) -> None:
+    task = app.get("flow_preview_maintenance")
+    if task is not None:
+        task.cancel()
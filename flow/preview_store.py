@@ -0,0 +1,433 @@
+import os
+import json
+import shutil
+import sqlite3
+import hashlib
+import threading
+import time
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+from .constants import DATA_DIR, FLOWMSG, logger
+from .http_cache import make_etag
+from .preview_cache import preview_cache, MISSING
+from .image_processing import (
+    MODEL_PREVIEW_THUMBNAIL_WIDTH, PREVIEW_RENDITION_SIZES, RENDITION_FORMATS,
+    make_preview_renditions
+)
+
+PREVIEWS_REGISTRY_DIR = DATA_DIR / "model_previews_registry"
+PREVIEWS_IMAGES_DIR = DATA_DIR / "model_previews"
+PREVIEWS_BLOBS_DIR = DATA_DIR / "model_preview_blobs"
+PREVIEWS_DB_PATH = DATA_DIR / "model_previews.sqlite3"
+THUMBNAIL_FILENAME = "thumbnail.jpg"
+SOURCE_FILENAME = "full"
+CACHE_ENTRY_OVERHEAD = 256
+HASH_CHUNK_SIZE = 1024 * 1024
+_data_folders_ready = False
+_pending_access: Dict[str, float] = {}
+
+def ensure_data_folders():
+    global _data_folders_ready
+    if _data_folders_ready:
+        return
+    try:
+        DATA_DIR.mkdir(parents=True, exist_ok=True)
+        PREVIEWS_BLOBS_DIR.mkdir(parents=True, exist_ok=True)
+        _data_folders_ready = True
+    except Exception as e:
+        logger.error(f"{FLOWMSG}: Could not create data dirs: {e}")
+
+def pathToKey(model_path: str) -> str:
+    return model_path.replace('\\', '/')
+
+def get_filename_only(model_path: str) -> str:
+    fwd = pathToKey(model_path)
+    return os.path.basename(fwd)
+
+@lru_cache(maxsize=4096)
+def get_preview_id(model_path: str) -> str:
+    filename = get_filename_only(model_path)
+    h = hashlib.sha1(filename.encode('utf-8')).hexdigest()
+    return h[:16]
+
+def get_preview_folder(preview_id: str) -> Path:
+    return PREVIEWS_IMAGES_DIR / preview_id[0] / preview_id[:2] / preview_id
+
+def get_blob_folder(blob_hash: str) -> Path:
+    return PREVIEWS_BLOBS_DIR / blob_hash[:2] / blob_hash
+
+def get_blob_version(blob_hash: str) -> str:
+    return blob_hash[:16]
+
+def hash_file(path: Path) -> str:
+    h = hashlib.sha256()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def get_rendition_filename(size: int, fmt: str) -> str:
+    if size == MODEL_PREVIEW_THUMBNAIL_WIDTH and fmt == "jpeg":
+        return THUMBNAIL_FILENAME
+    return f"thumb_{size}.{RENDITION_FORMATS[fmt][1]}"
+
+class PreviewRegistry:
+    def __init__(self, db_path: Path, legacy_dir: Path):
+        self.db_path = db_path
+        self.legacy_dir = legacy_dir
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.RLock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            ensure_data_folders()
+            conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            try:
+                self._upgrade_schema(conn)
+            except BaseException:
+                conn.close()
+                raise
+            self._conn = conn
+        return self._conn
+
+    def _upgrade_schema(self, conn: sqlite3.Connection) -> None:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version < 1:
+            with conn:
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS previews (
+                        preview_id TEXT PRIMARY KEY,
+                        model_path TEXT NOT NULL,
+                        mime_type TEXT,
+                        mtime REAL NOT NULL,
+                        thumb_size INTEGER NOT NULL,
+                        version TEXT NOT NULL
+                    )
+                """)
+                conn.execute("CREATE INDEX IF NOT EXISTS previews_model_path ON previews (model_path)")
+                migrated = self._migrate_legacy(conn)
+                conn.execute("PRAGMA user_version = 1")
+            if migrated:
+                logger.info(f"{FLOWMSG}: Migrated {migrated} model preview registry entries")
+        if version < 2:
+            self._add_column(conn, "previews", "blob_hash", "TEXT")
+            with conn:
+                conn.execute("CREATE INDEX IF NOT EXISTS previews_blob_hash ON previews (blob_hash)")
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS blobs (
+                        blob_hash TEXT PRIMARY KEY,
+                        refcount INTEGER NOT NULL
+                    )
+                """)
+            moved = self._migrate_to_blobs(conn)
+            conn.execute("PRAGMA user_version = 2")
+            if moved:
+                logger.info(f"{FLOWMSG}: Moved {moved} model previews into the content-addressed store")
+        if version < 3:
+            self._add_column(conn, "previews", "accessed", "REAL")
+            with conn:
+                conn.execute("UPDATE previews SET accessed = mtime WHERE accessed IS NULL")
+            conn.execute("PRAGMA user_version = 3")
+
+    def _add_column(self, conn: sqlite3.Connection, table: str, column: str, decl: str) -> None:
+        # ALTER TABLE commits on its own, so an upgrade that failed further on has already added it.
+        columns = {row["name"] for row in conn.execute(f"PRAGMA table_info({table})")}
+        if column not in columns:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+    def _migrate_legacy(self, conn: sqlite3.Connection) -> int:
+        if not self.legacy_dir.is_dir():
+            return 0
+        migrated = 0
+        for root, dirs, files in os.walk(self.legacy_dir):
+            for filename in files:
+                if not filename.endswith(".json"):
+                    continue
+                regp = Path(root) / filename
+                try:
+                    with regp.open("r", encoding="utf-8") as f:
+                        reg_data = json.load(f)
+                    mp = reg_data.get("modelPath")
+                    pid = reg_data.get("previewId")
+                    if not mp or not pid:
+                        continue
+                    st = (get_preview_folder(pid) / THUMBNAIL_FILENAME).stat()
+                except FileNotFoundError:
+                    continue
+                except Exception as ex:
+                    logger.error(f"{FLOWMSG}: Error reading registry {regp}: {ex}")
+                    continue
+                conn.execute(
+                    "INSERT OR REPLACE INTO previews VALUES (?, ?, ?, ?, ?, ?)",
+                    (pid, mp, reg_data.get("mime_type"), st.st_mtime, st.st_size, f"{st.st_mtime_ns:x}-{st.st_size:x}")
+                )
+                migrated += 1
+        return migrated
+
+    def _migrate_to_blobs(self, conn: sqlite3.Connection) -> int:
+        # Each preview is recorded against its blob before its folder moves, so a
+        # migration interrupted at any point picks up where it stopped.
+        for row in conn.execute("SELECT preview_id FROM previews WHERE blob_hash IS NULL").fetchall():
+            pid = row["preview_id"]
+            folder = get_preview_folder(pid)
+            thumb = folder / THUMBNAIL_FILENAME
+            if not thumb.exists():
+                with conn:
+                    conn.execute("DELETE FROM previews WHERE preview_id = ?", (pid,))
+                continue
+            sources = sorted(folder.glob(f"{SOURCE_FILENAME}.*"))
+            blob_hash = hash_file(sources[0] if sources else thumb)
+            with conn:
+                conn.execute("UPDATE previews SET blob_hash = ? WHERE preview_id = ?", (blob_hash, pid))
+                self._retain(conn, blob_hash)
+
+        moved = 0
+        for row in conn.execute("SELECT preview_id, blob_hash FROM previews WHERE blob_hash IS NOT NULL").fetchall():
+            pid = row["preview_id"]
+            folder = get_preview_folder(pid)
+            if not folder.is_dir():
+                continue
+            blob_hash = row["blob_hash"]
+            blob_folder = get_blob_folder(blob_hash)
+            if (blob_folder / THUMBNAIL_FILENAME).exists():
+                shutil.rmtree(folder)
+            else:
+                blob_folder.parent.mkdir(parents=True, exist_ok=True)
+                shutil.rmtree(blob_folder, ignore_errors=True)
+                shutil.move(str(folder), str(blob_folder))
+            st = (blob_folder / THUMBNAIL_FILENAME).stat()
+            with conn:
+                conn.execute(
+                    "UPDATE previews SET mtime = ?, thumb_size = ?, version = ? WHERE preview_id = ?",
+                    (st.st_mtime, st.st_size, get_blob_version(blob_hash), pid)
+                )
+            moved += 1
+        return moved
+
+    def _retain(self, conn: sqlite3.Connection, blob_hash: str) -> None:
+        conn.execute(
+            "INSERT INTO blobs (blob_hash, refcount) VALUES (?, 1) "
+            "ON CONFLICT (blob_hash) DO UPDATE SET refcount = refcount + 1",
+            (blob_hash,)
+        )
+
+    def _release(self, conn: sqlite3.Connection, blob_hash: Optional[str]) -> Optional[str]:
+        if not blob_hash:
+            return None
+        conn.execute("UPDATE blobs SET refcount = refcount - 1 WHERE blob_hash = ?", (blob_hash,))
+        row = conn.execute("SELECT refcount FROM blobs WHERE blob_hash = ?", (blob_hash,)).fetchone()
+        if row is not None and row["refcount"] <= 0:
+            conn.execute("DELETE FROM blobs WHERE blob_hash = ?", (blob_hash,))
+            return blob_hash
+        return None
+
+    def assign(self, preview_id: str, model_path: str, mime_type: Optional[str],
+               blob_hash: str, thumb_stat: os.stat_result) -> Optional[str]:
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                row = conn.execute("SELECT blob_hash FROM previews WHERE preview_id = ?", (preview_id,)).fetchone()
+                previous = row["blob_hash"] if row else None
+                conn.execute(
+                    f"INSERT OR REPLACE INTO previews ({ENTRY_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (preview_id, model_path, mime_type, thumb_stat.st_mtime,
+                     thumb_stat.st_size, get_blob_version(blob_hash), blob_hash, time.time())
+                )
+                if previous == blob_hash:
+                    return None
+                self._retain(conn, blob_hash)
+                return self._release(conn, previous)
+
+    def delete(self, preview_id: str) -> Tuple[bool, Optional[str]]:
+        deleted, released = self.delete_many([preview_id])
+        return bool(deleted), (released[0] if released else None)
+
+    def delete_many(self, preview_ids: Iterable[str]) -> Tuple[int, List[str]]:
+        deleted = 0
+        released = []
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                for preview_id in preview_ids:
+                    row = conn.execute("SELECT blob_hash FROM previews WHERE preview_id = ?", (preview_id,)).fetchone()
+                    if row is None:
+                        continue
+                    conn.execute("DELETE FROM previews WHERE preview_id = ?", (preview_id,))
+                    deleted += 1
+                    blob_hash = self._release(conn, row["blob_hash"])
+                    if blob_hash:
+                        released.append(blob_hash)
+        return deleted, released
+
+    def touch(self, accessed: Dict[str, float]) -> None:
+        if not accessed:
+            return
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.executemany(
+                    "UPDATE previews SET accessed = MAX(COALESCE(accessed, 0), ?) WHERE preview_id = ?",
+                    [(ts, pid) for pid, ts in accessed.items()]
+                )
+
+    def is_referenced(self, blob_hash: str) -> bool:
+        with self._lock:
+            row = self._connect().execute("SELECT 1 FROM blobs WHERE blob_hash = ?", (blob_hash,)).fetchone()
+        return row is not None
+
+    def blob_hashes(self) -> Set[str]:
+        with self._lock:
+            rows = self._connect().execute("SELECT blob_hash FROM blobs").fetchall()
+        return {row["blob_hash"] for row in rows}
+
+    def vacuum(self) -> None:
+        with self._lock:
+            self._connect().execute("VACUUM")
+
+    def list_entries(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._connect().execute(
+                f"SELECT {ENTRY_COLUMNS} FROM previews ORDER BY preview_id"
+            ).fetchall()
+        return [_row_to_entry(row) for row in rows]
+
+    def list_page(self, after: Optional[str], limit: int) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._connect().execute(
+                f"SELECT {ENTRY_COLUMNS} FROM previews WHERE preview_id > ? ORDER BY preview_id LIMIT ?",
+                (after or "", limit)
+            ).fetchall()
+        return [_row_to_entry(row) for row in rows]
+
+ENTRY_COLUMNS = "preview_id, model_path, mime_type, mtime, thumb_size, version, blob_hash, accessed"
+
+def _row_to_entry(row: sqlite3.Row) -> Dict[str, Any]:
+    return {
+        "previewId": row["preview_id"],
+        "modelPath": row["model_path"],
+        "mimeType": row["mime_type"],
+        "mtime": row["mtime"],
+        "thumbSize": row["thumb_size"],
+        "version": row["version"],
+        "blobHash": row["blob_hash"],
+        "accessed": row["accessed"],
+    }
+
+preview_registry = PreviewRegistry(PREVIEWS_DB_PATH, PREVIEWS_REGISTRY_DIR)
+
+def load_registry_index() -> Dict[str, Dict[str, Any]]:
+    key = ("registry",)
+    cached = preview_cache.get(key)
+    if cached is not MISSING:
+        return cached
+
+    index = {entry["previewId"]: entry for entry in preview_registry.list_entries()}
+    size = sum(len(entry["modelPath"]) + CACHE_ENTRY_OVERHEAD for entry in index.values()) + CACHE_ENTRY_OVERHEAD
+    preview_cache.put(key, index, size)
+    return index
+
+def get_preview_entry(model_path: str) -> Optional[Dict[str, str]]:
+    entry = load_registry_index().get(get_preview_id(model_path))
+    if not entry:
+        return None
+    return {"previewId": entry["previewId"], "version": entry["version"]}
+
+def store_preview_blob(source_path: Path, blob_hash: str, extension: str) -> os.stat_result:
+    blob_folder = get_blob_folder(blob_hash)
+    thumb = blob_folder / THUMBNAIL_FILENAME
+    if thumb.exists():
+        # The caller keeps source_path until assign() has retained the blob, in case
+        # a concurrent release removes it first. Touching the folder keeps the
+        # maintenance sweep from treating it as stray meanwhile.
+        os.utime(blob_folder)
+        return thumb.stat()
+
+    renditions = make_preview_renditions(str(source_path))
+    blob_folder.mkdir(parents=True, exist_ok=True)
+    os.replace(source_path, blob_folder / f"{SOURCE_FILENAME}.{extension}")
+    legacy = (MODEL_PREVIEW_THUMBNAIL_WIDTH, "jpeg")
+    # The 128px JPEG is written last; its presence marks the blob as complete.
+    for size, fmt in [key for key in renditions if key != legacy] + [legacy]:
+        with (blob_folder / get_rendition_filename(size, fmt)).open("wb") as f:
+            f.write(renditions[(size, fmt)])
+    return thumb.stat()
+
+def remove_preview_blobs(blob_hashes: Iterable[Optional[str]]) -> None:
+    for blob_hash in blob_hashes:
+        if not blob_hash:
+            continue
+        blob_folder = get_blob_folder(blob_hash)
+        trash = blob_folder.with_name(f".removing-{blob_folder.name}")
+        with preview_registry._lock:
+            # An upload may have retained the blob again since it was released.
+            if preview_registry.is_referenced(blob_hash) or not blob_folder.is_dir():
+                continue
+            os.replace(blob_folder, trash)
+        shutil.rmtree(trash, ignore_errors=True)
+        preview_cache.invalidate(*blob_cache_keys(blob_hash))
+
+def pick_rendition_size(requested: int) -> int:
+    for size in sorted(PREVIEW_RENDITION_SIZES):
+        if size >= requested:
+            return size
+    return max(PREVIEW_RENDITION_SIZES)
+
+def blob_cache_keys(blob_hash: str) -> List[Tuple[str, str, int, str]]:
+    return [("blob", blob_hash, size, fmt) for size in PREVIEW_RENDITION_SIZES for fmt in RENDITION_FORMATS]
+
+def load_blob_rendition(blob_hash: str, size: int = MODEL_PREVIEW_THUMBNAIL_WIDTH, fmt: str = "jpeg") -> Optional[Dict[str, Any]]:
+    key = ("blob", blob_hash, size, fmt)
+    cached = preview_cache.get(key)
+    if cached is not MISSING:
+        return cached
+
+    folder = get_blob_folder(blob_hash)
+    candidates = [(size, fmt)]
+    if (size, fmt) != (MODEL_PREVIEW_THUMBNAIL_WIDTH, "jpeg"):
+        # Previews saved before renditions existed only have the 128px JPEG.
+        candidates.append((MODEL_PREVIEW_THUMBNAIL_WIDTH, "jpeg"))
+
+    for served_size, served_fmt in candidates:
+        thumb = folder / get_rendition_filename(served_size, served_fmt)
+        try:
+            st = thumb.stat()
+            with thumb.open("rb") as tf:
+                b = tf.read()
+            break
+        except FileNotFoundError:
+            continue
+    else:
+        preview_cache.put(key, None, CACHE_ENTRY_OVERHEAD)
+        return None
+
+    version = get_blob_version(blob_hash)
+    entry = {
+        "version": version,
+        "mtime": st.st_mtime,
+        "etag": make_etag(version, str(served_size), served_fmt),
+        "contentType": RENDITION_FORMATS[served_fmt][2],
+        "data": b,
+    }
+    preview_cache.put(key, entry, len(b) + CACHE_ENTRY_OVERHEAD)
+    return entry
+
+def load_preview_thumbnail(pid: str, size: int = MODEL_PREVIEW_THUMBNAIL_WIDTH, fmt: str = "jpeg") -> Optional[Dict[str, Any]]:
+    entry = load_registry_index().get(pid)
+    if not entry or not entry["blobHash"]:
+        return None
+    return load_blob_rendition(entry["blobHash"], size, fmt)
+
+def record_preview_access(pid: str) -> None:
+    _pending_access[pid] = time.time()
+
+def flush_preview_access() -> None:
+    global _pending_access
+    pending, _pending_access = _pending_access, {}
+    preview_registry.touch(pending)
+
+def invalidate_registry_cache() -> None:
+    preview_cache.invalidate(("registry",))
@@ -1,21 +1,160 @@
+import time
+import asyncio
+import threading
+from collections import OrderedDict
 from aiohttp import web
+from aiohttp.web_urldispatcher import PrefixResource, ResourceRoute, UrlMappingMatchInfo
 from pathlib import Path
+from typing import Dict, Optional
+from yarl import URL
+from .flow_catalog import FlowCatalog
+from .http_cache import make_etag, conditional_response, variant_response
+from .preview_cache import response_cache, MISSING
+from .static_assets import precompressed_file_response
+from .asset_manifest import get_asset_manifest
+from .flow_pages import render_flow_page
 
-class RouteManager:
+FILE_LOOKUP_TTL = 2.0
+FILE_LOOKUP_MAX_ENTRIES = 4096
 
-    @staticmethod
-    def create_routes(base_path: str, app_dir: Path) -> web.RouteTableDef:
-        routes = web.RouteTableDef()
-        index_html = app_dir / 'index.html'
+def resolve_flow_file(flow_dir: Path, filename: str) -> Optional[Path]:
+    if not filename or Path(filename).is_absolute():
+        return None
+    try:
+        root = flow_dir.resolve()
+        file_path = (root / filename).resolve()
+        file_path.relative_to(root)
+    except (OSError, ValueError):
+        return None
+    return file_path if file_path.is_file() else None
 
-        @routes.get(f"/{base_path}")
-        async def serve_html(request: web.Request) -> web.FileResponse:
-            return web.FileResponse(index_html)
+class FileLookupCache:
+    # Remembers path checks for a couple of seconds so hot assets skip the
+    # realpath/stat round trip on every request.
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[tuple[Path, str], tuple[float, Optional[Path]]]" = OrderedDict()
+        self._lock = threading.Lock()
 
-        for static_dir in ['css', 'js', 'media']:
-            static_path = app_dir / static_dir
-            if static_path.is_dir():
-                routes.static(f"/{static_dir}/", path=static_path)
+    def lookup(self, flow_dir: Path, filename: str) -> Optional[Path]:
+        key = (flow_dir, filename)
+        now = time.monotonic()
+        with self._lock:
+            item = self._entries.get(key)
+            if item is not None and item[0] > now:
+                self._entries.move_to_end(key)
+                return item[1]
+        file_path = resolve_flow_file(flow_dir, filename)
+        with self._lock:
+            self._entries[key] = (now + self.ttl, file_path)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return file_path
 
-        routes.static(f"/{base_path}/", path=app_dir, show_index=False)
-        return routes
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+file_lookup_cache = FileLookupCache(FILE_LOOKUP_TTL, FILE_LOOKUP_MAX_ENTRIES)
+
+def load_flow_page(file_path: Path):
+    st = file_path.stat()
+    manifest = get_asset_manifest()
+    # Keyed by inode, so every flow whose index.html is linked to the same blob shares one entry.
+    key = ("flow-page", manifest.build, st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size)
+    cached = response_cache.get(key)
+    if cached is MISSING:
+        data = file_path.read_bytes()
+        cached = {
+            # Point /core/ references at the current immutable asset build.
+            "data": manifest.rewrite(data) if manifest.build else data,
+            "etag": make_etag(f"{st.st_ino:x}", f"{st.st_mtime_ns:x}", f"{st.st_size:x}", manifest.build),
+        }
+        response_cache.put(key, cached, len(cached["data"]))
+    return cached
+
+def make_static_handler(root_dir: Path):
+    async def serve_static(request: web.Request) -> web.StreamResponse:
+        loop = asyncio.get_running_loop()
+        file_path = await loop.run_in_executor(None, file_lookup_cache.lookup, root_dir, request.match_info["filename"])
+        if file_path is None:
+            raise web.HTTPNotFound()
+        return await precompressed_file_response(request, file_path)
+    return serve_static
+
+class FlowStaticResource(PrefixResource):
+    # The single resolver for everything under /flow: fixed mounts such as the
+    # linker, every flow in the catalog, and the Flow app itself for the rest.
+    # Picking the directory is a dict lookup however many flows are installed.
+    METHODS = ("GET", "HEAD")
+
+    def __init__(self, prefix: str, catalog: FlowCatalog, root_dir: Path, mounts: Dict[str, Path]):
+        super().__init__(prefix)
+        self._catalog = catalog
+        self._root_dir = root_dir
+        self._mounts = mounts
+        self._routes = {method: ResourceRoute(method, self._handle, self) for method in self.METHODS}
+        self._allowed_methods = set(self.METHODS)
+
+    @property
+    def canonical(self) -> str:
+        return f"{self._prefix}/{{url}}"
+
+    def url_for(self, url: str = "", filename: str = "") -> URL:
+        path = f"{self._prefix}/{url}" if url else self._prefix
+        return URL.build(path=f"{path}/{filename}" if filename else path)
+
+    def get_info(self):
+        return {"prefix": self._prefix, "directory": self._root_dir, "mounts": self._mounts}
+
+    def _flow_dir(self, url: str) -> Optional[Path]:
+        if url in self._mounts:
+            return self._mounts[url]
+        entry = self._catalog.get(url)
+        return entry["dir"] if entry is not None else None
+
+    async def resolve(self, request: web.Request):
+        path = request.rel_url.path
+        if path == self._prefix:
+            match_dict = {"url": "", "filename": ""}
+        elif path.startswith(self._prefix2):
+            rest = path[len(self._prefix2):]
+            url, _, filename = rest.partition("/")
+            if url and self._flow_dir(url) is not None:
+                match_dict = {"url": url, "filename": filename}
+            else:
+                match_dict = {"url": "", "filename": rest}
+        else:
+            return None, set()
+        if request.method not in self._allowed_methods:
+            return None, self._allowed_methods
+        return UrlMappingMatchInfo(match_dict, self._routes[request.method]), self._allowed_methods
+
+    def __len__(self) -> int:
+        return len(self._routes)
+
+    def __iter__(self):
+        return iter(self._routes.values())
+
+    async def _handle(self, request: web.Request) -> web.StreamResponse:
+        url = request.match_info["url"]
+        flow_dir = self._flow_dir(url) if url else self._root_dir
+        if flow_dir is None:
+            raise web.HTTPNotFound()
+        filename = request.match_info["filename"] or "index.html"
+        loop = asyncio.get_running_loop()
+        file_path = await loop.run_in_executor(None, file_lookup_cache.lookup, flow_dir, filename)
+        if file_path is None:
+            raise web.HTTPNotFound()
+        if url and url not in self._mounts and filename == "index.html":
+            page = await loop.run_in_executor(None, render_flow_page, url, flow_dir, file_path)
+            response = variant_response(request, page["variants"], "text/html", page["etag"])
+            if page["links"]:
+                response.headers["Link"] = page["links"]
+            return response
+        if file_path.suffix == ".html":
+            page = await loop.run_in_executor(None, load_flow_page, file_path)
+            return conditional_response(request, page["data"], "text/html", page["etag"])
+        return await precompressed_file_response(request, file_path)
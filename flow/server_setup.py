@@ -1,7 +1,5 @@
-from aiohttp import web
 import server
 from .flow_manager import FlowManager
-from .downloader import download_update_flows
 from .constants import FLOWMSG, logger
 
 def setup_server() -> None:
@@ -11,8 +9,6 @@ def setup_server() -> None:
         logger.error(f"{FLOWMSG}: Failed to get server instance: {e}")
         return
 
-    download_update_flows()
-
     try:
         FlowManager.setup_app_routes(server_instance.app)
     except Exception as e:
@@ -0,0 +1,167 @@
+import os
+import gzip
+import time
+import asyncio
+import mimetypes
+from pathlib import Path
+from stat import S_ISREG
+from typing import Any, Dict, Iterable, Optional, Set, Tuple
+from aiohttp import web, hdrs
+from .constants import CORE_PATH, FLOW_PATH, LINKER_PATH, FLOWMSG, logger
+from .flow_storage import atomic_write_bytes
+from .http_cache import COMPRESS_MIN_BYTES
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+PRECOMPRESS_SUFFIXES = frozenset({".js", ".mjs", ".css", ".html", ".json", ".svg", ".txt", ".map", ".xml", ".wasm"})
+PRECOMPRESS_DIRS = (CORE_PATH, FLOW_PATH, LINKER_PATH)
+# A sibling only pays for itself if it is noticeably smaller than the original.
+PRECOMPRESS_MIN_RATIO = 0.9
+
+def get_compressors() -> Dict[str, Any]:
+    compressors = {".gz": lambda data: gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        compressors[".br"] = lambda data: brotli.compress(data, quality=11)
+    return compressors
+
+def is_fresh(sibling_st: os.stat_result, source_st: os.stat_result) -> bool:
+    # Siblings are stamped with the source's mtime when written, so any edit to
+    # the source makes them stale until they are regenerated.
+    return sibling_st.st_mtime_ns == source_st.st_mtime_ns
+
+def new_report() -> Dict[str, Any]:
+    return {"files": 0, "written": 0, "fresh": 0, "removed": 0, "bytesSaved": 0, "errors": 0}
+
+def precompress_file(path: Path, report: Dict[str, Any]) -> None:
+    st = path.stat()
+    if st.st_size < COMPRESS_MIN_BYTES:
+        return
+    report["files"] += 1
+    data = None
+    for suffix, compress in get_compressors().items():
+        sibling = path.with_name(path.name + suffix)
+        try:
+            if is_fresh(sibling.lstat(), st):
+                report["fresh"] += 1
+                continue
+        except FileNotFoundError:
+            pass
+        if data is None:
+            data = path.read_bytes()
+        compressed = compress(data)
+        if len(compressed) > len(data) * PRECOMPRESS_MIN_RATIO:
+            if sibling.exists():
+                sibling.unlink()
+                report["removed"] += 1
+            continue
+        atomic_write_bytes(sibling, compressed)
+        os.utime(sibling, ns=(st.st_atime_ns, st.st_mtime_ns))
+        report["written"] += 1
+        report["bytesSaved"] += len(data) - len(compressed)
+
+def remove_orphaned_sibling(path: Path, report: Dict[str, Any]) -> None:
+    source = path.with_suffix("")
+    if source.suffix in PRECOMPRESS_SUFFIXES and not source.exists():
+        path.unlink(missing_ok=True)
+        report["removed"] += 1
+
+def precompress_tree(root: Path, report: Dict[str, Any]) -> None:
+    sibling_suffixes = (".gz", ".br")
+    for dirpath, dirs, files in os.walk(root):
+        dirs[:] = [d for d in dirs if not d.startswith('.')]
+        for name in files:
+            path = Path(dirpath) / name
+            try:
+                if path.suffix in sibling_suffixes:
+                    remove_orphaned_sibling(path, report)
+                elif path.suffix in PRECOMPRESS_SUFFIXES:
+                    precompress_file(path, report)
+            except OSError as e:
+                report["errors"] += 1
+                logger.debug(f"{FLOWMSG}: Could not precompress {path}: {e}")
+
+def precompress_static_assets(roots: Iterable[Path] = PRECOMPRESS_DIRS) -> Dict[str, Any]:
+    started = time.perf_counter()
+    report = new_report()
+    for root in roots:
+        if root.is_dir():
+            precompress_tree(root, report)
+    report["durationMs"] = round((time.perf_counter() - started) * 1000, 1)
+    return report
+
+SIBLING_ENCODINGS = ((".br", "br"), (".gz", "gzip"))
+
+def accepted_encodings(accept_encoding: str) -> Set[str]:
+    accepted = set()
+    for item in accept_encoding.lower().split(","):
+        coding, _, params = item.partition(";")
+        name, _, value = params.partition("=")
+        try:
+            quality = float(value) if name.strip() == "q" else 1.0
+        except ValueError:
+            quality = 1.0
+        if quality > 0:
+            accepted.add(coding.strip())
+    return accepted
+
+def select_precompressed(path: Path, accept_encoding: str) -> Tuple[Path, Optional[str]]:
+    if path.suffix not in PRECOMPRESS_SUFFIXES:
+        return path, None
+    accepted = accepted_encodings(accept_encoding)
+    source_st = None
+    for suffix, encoding in SIBLING_ENCODINGS:
+        if encoding not in accepted:
+            continue
+        sibling = path.with_name(path.name + suffix)
+        try:
+            st = sibling.lstat()
+            source_st = source_st or path.stat()
+        except FileNotFoundError:
+            continue
+        if S_ISREG(st.st_mode) and is_fresh(st, source_st):
+            return sibling, encoding
+        # Left over from before the source was edited. Remove it so that the
+        # FileResponse for the source cannot pick it up either.
+        sibling.unlink(missing_ok=True)
+    return path, None
+
+class EncodedFileResponse(web.FileResponse):
+    # Sends a precompressed sibling as it is on disk.
+    def enable_compression(self, *args: Any, **kwargs: Any) -> None:
+        pass
+
+async def precompressed_file_response(request: web.Request, path: Path, headers: Optional[Dict[str, str]] = None) -> web.FileResponse:
+    file_path, encoding = await asyncio.get_running_loop().run_in_executor(
+        None, select_precompressed, path, request.headers.get(hdrs.ACCEPT_ENCODING, "")
+    )
+    headers = dict(headers or {})
+    if path.suffix in PRECOMPRESS_SUFFIXES:
+        headers[hdrs.VARY] = hdrs.ACCEPT_ENCODING
+    if encoding is None:
+        return web.FileResponse(file_path, headers=headers)
+    headers[hdrs.CONTENT_ENCODING] = encoding
+    headers[hdrs.CONTENT_TYPE] = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+    return EncodedFileResponse(file_path, headers=headers)
+
+async def _precompress_on_startup() -> None:
+    try:
+        report = await asyncio.get_running_loop().run_in_executor(None, precompress_static_assets)
+    except Exception as e:
+        logger.error(f"{FLOWMSG}: Precompressing static assets failed: {e}")
+        return
+    if report["written"] or report["removed"]:
+        logger.info(
+            f"{FLOWMSG}: Precompressed {report['written']} static asset variants "
+            f"({report['bytesSaved']} bytes saved) in {report['durationMs']} ms"
+        )
+
+async def start_static_precompression(app: web.Application) -> None:
+    app["flow_static_precompression"] = asyncio.get_running_loop().create_task(_precompress_on_startup())
+
+async def stop_static_precompression(app: web.Application) -> None:
+    task = app.get("flow_static_precompression")
+    if task is not None:
+        task.cancel()
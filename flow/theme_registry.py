@@ -0,0 +1,125 @@
+import re
+import json
+import time
+import hashlib
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from .constants import ALLOWED_EXTENSIONS, CUSTOM_THEMES_DIR, FLOWMSG, logger
+from .http_cache import make_etag, compress_variants
+
+THEME_RECHECK_INTERVAL = 2.0
+COMBINED_THEMES_URL = "/flow/api/themes/combined.css"
+THEME_BLOCK_REGEX = re.compile(r'\[data-theme="([^"]+)"\]\s*\{([^}]+)\}')
+THEME_VARIABLE_REGEX = re.compile(r"(--[\w-]+)\s*:\s*([^;]+);")
+CSS_COMMENT_REGEX = re.compile(r"/\*.*?\*/", re.S)
+CSS_SPACE_REGEX = re.compile(r"\s+")
+CSS_PUNCTUATION_REGEX = re.compile(r"\s*([{};,>])\s*")
+
+def parse_theme_css(css: str) -> List[Dict[str, Any]]:
+    # Same rules as ThemeManager.extractThemesFromCSS, so both sides agree on what a theme is.
+    themes: List[Dict[str, Any]] = []
+    for value, block in THEME_BLOCK_REGEX.findall(css):
+        if any(theme["value"] == value for theme in themes):
+            continue
+        variables = {name: val.strip() for name, val in THEME_VARIABLE_REGEX.findall(block)}
+        themes.append({"value": value, "variables": variables})
+    return themes
+
+def minify_css(css: str) -> str:
+    css = CSS_COMMENT_REGEX.sub("", css)
+    css = CSS_SPACE_REGEX.sub(" ", css)
+    css = CSS_PUNCTUATION_REGEX.sub(r"\1", css)
+    css = css.replace(": ", ":").replace(";}", "}")
+    return css.strip()
+
+def is_balanced(css: str) -> bool:
+    depth = 0
+    for c in CSS_COMMENT_REGEX.sub("", css):
+        if c == "{":
+            depth += 1
+        elif c == "}":
+            depth -= 1
+            if depth < 0:
+                return False
+    return depth == 0
+
+class ThemeRegistry:
+    # Everything the theme picker needs from web/custom-themes, rebuilt only
+    # when a file is added, removed or touched.
+    def __init__(self, themes_dir: Path):
+        self.themes_dir = themes_dir
+        self._signature: Optional[tuple] = None
+        self._state: Dict[str, Any] = self._build({})
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    def _scan(self) -> Dict[str, Any]:
+        files = {}
+        if not self.themes_dir.is_dir():
+            return files
+        for path in self.themes_dir.iterdir():
+            if path.suffix.lstrip('.').lower() not in ALLOWED_EXTENSIONS:
+                continue
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            if path.is_file():
+                files[path.name] = (path, st.st_mtime_ns, st.st_size)
+        return files
+
+    def _build(self, files: Dict[str, Any]) -> Dict[str, Any]:
+        sources: Dict[str, bytes] = {}
+        index = []
+        combined = []
+        for name in sorted(files):
+            try:
+                data = files[name][0].read_bytes()
+            except OSError:
+                continue
+            sources[name] = data
+            css = data.decode("utf-8", errors="replace")
+            themes = parse_theme_css(css)
+            file_hash = hashlib.sha1(data).hexdigest()[:16]
+            included = bool(themes) and is_balanced(css)
+            if themes and not included:
+                # One unclosed block would swallow every theme after it in the combined sheet.
+                logger.warning(f"{FLOWMSG}: Leaving unbalanced theme file '{name}' out of the combined stylesheet")
+            if included:
+                combined.append(minify_css(css))
+            index.append({
+                "name": name, "hash": file_hash, "url": f"/core/css/themes/{name}",
+                "combined": included, "themes": themes,
+            })
+
+        combined_css = "\n".join(combined).encode("utf-8")
+        version = hashlib.sha1(combined_css + json.dumps(index, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+        body = json.dumps({
+            "version": version,
+            "combinedUrl": f"{COMBINED_THEMES_URL}?v={version}",
+            "files": index,
+        }, separators=(",", ":")).encode("utf-8")
+        return {
+            "version": version,
+            "names": list(sources),
+            "listBody": json.dumps(list(sources)).encode("utf-8"),
+            "listEtag": make_etag("list", version),
+            "sources": {name: (data, make_etag(hashlib.sha1(data).hexdigest()[:20])) for name, data in sources.items()},
+            "index": {"etag": make_etag("index", version), "variants": compress_variants(body)},
+            "combined": {"etag": make_etag("combined", version), "variants": compress_variants(combined_css)},
+        }
+
+    def current(self) -> Dict[str, Any]:
+        if time.monotonic() - self._checked < THEME_RECHECK_INTERVAL:
+            return self._state
+        with self._lock:
+            self._checked = time.monotonic()
+            files = self._scan()
+            signature = tuple((name, mtime, size) for name, (_, mtime, size) in sorted(files.items()))
+            if signature != self._signature:
+                self._state = self._build(files)
+                self._signature = signature
+            return self._state
+
+theme_registry = ThemeRegistry(CUSTOM_THEMES_DIR)
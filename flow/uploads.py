@@ -0,0 +1,175 @@
+import os
+import re
+import json
+import base64
+import binascii
+import tempfile
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, Optional
+from aiohttp import BodyPartReader, web
+from .flow_storage import DEFAULT_FILE_MODE
+
+UPLOAD_CHUNK_SIZE = 64 * 1024
+# Uploads stream into .upload-*.tmp files; one untouched for this long was abandoned.
+STALE_UPLOAD_SECONDS = 3600
+DATA_URL_MAX_HEADER = 256
+DATA_URL_HEADER_REGEX = re.compile(r'^data:(image/\w+);base64$')
+
+class UploadTooLarge(Exception):
+    def __init__(self, limit: int, part: Optional[str] = None):
+        what = f"'{part}'" if part else "Upload"
+        super().__init__(f"{what} exceeds the {limit} byte limit")
+        self.limit = limit
+
+class InvalidUpload(Exception):
+    pass
+
+async def iter_part_chunks(part: BodyPartReader) -> AsyncIterator[bytes]:
+    while True:
+        chunk = await part.read_chunk(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        yield chunk
+
+async def stream_to_temp_file(chunks: AsyncIterator[bytes], directory: Path, max_bytes: int, hasher=None) -> Path:
+    fd, tmp_name = tempfile.mkstemp(dir=directory, prefix=".upload-", suffix=".tmp")
+    tmp_path = Path(tmp_name)
+    written = 0
+    try:
+        with os.fdopen(fd, "wb") as f:
+            async for chunk in chunks:
+                written += len(chunk)
+                if written > max_bytes:
+                    raise UploadTooLarge(max_bytes)
+                f.write(chunk)
+                if hasher is not None:
+                    hasher.update(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, DEFAULT_FILE_MODE)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    return tmp_path
+
+class UploadBudget:
+    def __init__(self, max_total: int):
+        self.max_total = max_total
+        self.used = 0
+
+    async def limit(self, chunks: AsyncIterator[bytes], max_bytes: int, part: str) -> AsyncIterator[bytes]:
+        read = 0
+        async for chunk in chunks:
+            read += len(chunk)
+            self.used += len(chunk)
+            if read > max_bytes:
+                raise UploadTooLarge(max_bytes, part)
+            if self.used > self.max_total:
+                raise UploadTooLarge(self.max_total)
+            yield chunk
+
+class DataUrlDecoder:
+    # Decodes a "data:image/...;base64," string as it arrives, four characters at a time.
+    def __init__(self, part: str):
+        self.part = part
+        self.mime_type: Optional[str] = None
+        self._head = b""
+        self._pending = b""
+
+    def feed(self, chunk: bytes) -> bytes:
+        if self.mime_type is None:
+            self._head += chunk
+            head, sep, chunk = self._head.partition(b",")
+            if not sep:
+                if len(self._head) > DATA_URL_MAX_HEADER:
+                    raise InvalidUpload(f"Invalid data URL format for '{self.part}'")
+                return b""
+            match = DATA_URL_HEADER_REGEX.match(head.decode('ascii', 'replace'))
+            if not match:
+                raise InvalidUpload(f"Invalid data URL format for '{self.part}'")
+            self.mime_type = match.group(1)
+            self._head = b""
+
+        data = self._pending + chunk.translate(None, b" \t\r\n")
+        usable = len(data) - len(data) % 4
+        self._pending = data[usable:]
+        try:
+            return base64.b64decode(data[:usable], validate=True)
+        except binascii.Error:
+            raise InvalidUpload(f"Invalid Base64 encoding in '{self.part}'")
+
+    def finish(self) -> None:
+        if self.mime_type is None:
+            raise InvalidUpload(f"Invalid data URL format for '{self.part}'")
+        if self._pending:
+            raise InvalidUpload(f"Invalid Base64 encoding in '{self.part}'")
+
+async def decode_data_url(chunks: AsyncIterator[bytes], decoder: DataUrlDecoder) -> AsyncIterator[bytes]:
+    async for chunk in chunks:
+        decoded = decoder.feed(chunk)
+        if decoded:
+            yield decoded
+    decoder.finish()
+
+class FlowUpload:
+    def __init__(self):
+        self.flow_config: Optional[Dict[str, Any]] = None
+        self.wf_path: Optional[Path] = None
+        self.thumbnail_path: Optional[Path] = None
+        self.thumbnail_mime: Optional[str] = None
+
+    def discard_wf(self) -> None:
+        if self.wf_path is not None:
+            self.wf_path.unlink(missing_ok=True)
+            self.wf_path = None
+
+    def discard_thumbnail(self) -> None:
+        if self.thumbnail_path is not None:
+            self.thumbnail_path.unlink(missing_ok=True)
+            self.thumbnail_path = None
+
+    def cleanup(self) -> None:
+        self.discard_wf()
+        self.discard_thumbnail()
+
+async def read_flow_upload(request: web.Request, tmp_dir: Path, max_config_bytes: int,
+                           max_part_bytes: int, max_thumbnail_bytes: int, max_total_bytes: int) -> FlowUpload:
+    upload = FlowUpload()
+    budget = UploadBudget(max_total_bytes)
+    try:
+        reader = await request.multipart()
+        while True:
+            part = await reader.next()
+            if part is None:
+                break
+
+            if part.name == 'flowConfig':
+                content = bytearray()
+                async for chunk in budget.limit(iter_part_chunks(part), max_config_bytes, part.name):
+                    content += chunk
+                try:
+                    upload.flow_config = json.loads(content)
+                except (json.JSONDecodeError, UnicodeDecodeError):
+                    raise InvalidUpload("Invalid JSON format in 'flowConfig'")
+                if not isinstance(upload.flow_config, dict) or not upload.flow_config.get('url'):
+                    raise InvalidUpload("Missing 'url' in 'flowConfig'")
+
+            elif part.name == 'wf':
+                upload.discard_wf()
+                chunks = budget.limit(iter_part_chunks(part), max_part_bytes, part.name)
+                upload.wf_path = await stream_to_temp_file(chunks, tmp_dir, max_part_bytes)
+
+            elif part.name == 'thumbnail':
+                upload.discard_thumbnail()
+                decoder = DataUrlDecoder(part.name)
+                chunks = budget.limit(iter_part_chunks(part), max_thumbnail_bytes, part.name)
+                upload.thumbnail_path = await stream_to_temp_file(decode_data_url(chunks, decoder), tmp_dir, max_thumbnail_bytes)
+                upload.thumbnail_mime = decoder.mime_type
+
+            else:
+                async for _ in budget.limit(iter_part_chunks(part), max_part_bytes, part.name or "part"):
+                    pass
+    except BaseException:
+        upload.cleanup()
+        raise
+    return upload
@@ -122,6 +122,11 @@ function gatherLeafPaths(nestedBranch, parentPath) {
     return results;
 }
 
+function previewEntryToUrl(entry) {
+    if (!entry || !entry.previewId) return null;
+    return `/flow/api/model-preview/${entry.previewId}/thumbnail?v=${encodeURIComponent(entry.version)}`;
+}
+
 async function fetchThumbnailsForPaths(paths) {
     if (!paths || paths.length === 0) return;
 
@@ -134,32 +139,49 @@ async function fetchThumbnailsForPaths(paths) {
     }
     if (needed.length === 0) return;
 
-    const chunkSize = 50;
-    for (let i = 0; i < needed.length; i += chunkSize) {
-        const slice = needed.slice(i, i + chunkSize);
-        await doPostRequestForSlice(slice);
-        updateVisibleUI();
-    }
+    await streamPreviewEntries(needed);
+    updateVisibleUI();
 }
 
-async function doPostRequestForSlice(pathsSlice) {
+async function streamPreviewEntries(paths) {
     try {
-        const payload = { paths: pathsSlice.map(pathToKey) };
+        const payload = { paths: paths.map(pathToKey) };
         const resp = await fetch('/flow/api/model-previews', {
             method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
+            headers: {
+                'Content-Type': 'application/json',
+                'Accept': 'application/x-ndjson',
+            },
             body: JSON.stringify(payload),
         });
         if (!resp.ok) {
-            console.warn('Failed chunk post. Status:', resp.status);
+            console.warn('Failed preview stream. Status:', resp.status);
             return;
         }
-        const data = await resp.json();
-        for (const [fwd, b64Url] of Object.entries(data)) {
-            modelImagePreviews[fwd] = b64Url;
+
+        const reader = resp.body.getReader();
+        const decoder = new TextDecoder();
+        let buffered = '';
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) break;
+            buffered += decoder.decode(value, { stream: true });
+            const lines = buffered.split('\n');
+            buffered = lines.pop();
+            applyPreviewLines(lines);
+            updateVisibleUI();
         }
+        applyPreviewLines([buffered]);
     } catch (err) {
-        console.error('Error in doPostRequestForSlice:', err);
+        console.error('Error in streamPreviewEntries:', err);
+    }
+}
+
+function applyPreviewLines(lines) {
+    for (const line of lines) {
+        if (!line.trim()) continue;
+        const entry = JSON.parse(line);
+        modelImagePreviews[entry.modelPath] = previewEntryToUrl(entry);
     }
 }
 
@@ -367,7 +389,7 @@ function addDragAndDropHandlers(element, originalPath) {
         const files = e.dataTransfer.files;
         if (files.length > 0) {
             const file = files[0];
-            if (file.type.startsWith('image/')) {
+            if (!file.type || file.type.startsWith('image/')) {
                 handleImageFile(file, originalPath);
             } else {
                 alert('Please drop a valid image file.');
@@ -438,7 +460,7 @@ function openImageSelector(originalPath) {
 
     fileInput.addEventListener('change', e => {
         const file = e.target.files[0];
-        if (file && file.type.startsWith('image/')) {
+        if (file && (!file.type || file.type.startsWith('image/'))) {
             handleImageFile(file, originalPath);
         } else {
             alert('Please select a valid image file.');
@@ -486,32 +508,26 @@ async function clearImageSelector(originalPath) {
     }
 }
 
-function handleImageFile(file, originalPath) {
-    const reader = new FileReader();
-    reader.onload = async function(event) {
-        const imageUrl = event.target.result;
-        try {
-            const payload = {
-                modelPath: pathToKey(originalPath),
-                base64Data: imageUrl
-            };
-            const resp = await fetch('/flow/api/model-preview', {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify(payload)
-            });
-            if (!resp.ok) {
-                const txt = await resp.text();
-                throw new Error(txt);
-            }
-            setModelImagePreview(originalPath, imageUrl);
-            updateVisibleUI();
-        } catch (err) {
-            console.error('Error uploading preview:', err);
-            alert('Error uploading preview: ' + err.message);
+async function handleImageFile(file, originalPath) {
+    try {
+        const modelPath = encodeURIComponent(pathToKey(originalPath));
+        const resp = await fetch(`/flow/api/model-preview?modelPath=${modelPath}`, {
+            method: 'POST',
+            // An empty type is sent as octet-stream and the server sniffs the image format.
+            headers: { 'Content-Type': file.type || 'application/octet-stream' },
+            body: file
+        });
+        if (!resp.ok) {
+            const txt = await resp.text();
+            throw new Error(txt);
         }
-    };
-    reader.readAsDataURL(file);
+        const entry = await resp.json();
+        setModelImagePreview(originalPath, previewEntryToUrl(entry));
+        updateVisibleUI();
+    } catch (err) {
+        console.error('Error uploading preview:', err);
+        alert('Error uploading preview: ' + err.message);
+    }
 }
 
 function setModelImagePreview(originalPath, imageUrl) {
@@ -614,7 +630,7 @@ export function populateDropdown(
                         return response.json();
                     })
                     .then(data => {
-                        const previewUrl = data[initialValue];
+                        const previewUrl = previewEntryToUrl(data[initialValue]);
                         if (previewUrl && previewImageElem) {
                             previewImageElem.src = previewUrl;
                             modelImagePreviews[pathToKey(initialValue)] = previewUrl;
@@ -149,7 +149,58 @@ class ThemeManager {
         return variables;
     }
 
+    async loadThemeRegistry() {
+        try {
+            const response = await fetch('/flow/api/themes');
+            if (!response.ok) {
+                return false;
+            }
+            const registry = await response.json();
+            if (registry.files.some(file => file.combined)) {
+                const cssResponse = await fetch(registry.combinedUrl);
+                if (!cssResponse.ok) {
+                    return false;
+                }
+                this.appendExternalCSS('combined-themes', await cssResponse.text());
+            }
+
+            for (const file of registry.files) {
+                if (file.themes.length === 0) {
+                    console.warn(`No valid themes found in CSS file: ${file.name}`);
+                    continue;
+                }
+                if (!file.combined) {
+                    // Left out of the combined sheet (e.g. unbalanced braces); load it on its own as before.
+                    console.warn(`Theme file ${file.name} is not in the combined stylesheet, loading it separately`);
+                    const cssResponse = await fetch(file.url);
+                    if (!cssResponse.ok) {
+                        console.warn(`Failed to load CSS file: ${file.name}`);
+                        continue;
+                    }
+                    this.appendExternalCSS(file.name, await cssResponse.text());
+                }
+                const styleName = this.formatStyleName(file.name);
+                this.externalCustomThemes.push({
+                    styleName: styleName,
+                    themes: file.themes.map(theme => ({
+                        name: this.formatThemeName(theme.value),
+                        value: theme.value,
+                        variables: theme.variables,
+                        themesSetName: styleName,
+                    }))
+                });
+            }
+            return true;
+        } catch (error) {
+            console.warn('Theme registry unavailable, loading theme files one by one:', error);
+            return false;
+        }
+    }
+
     async loadExternalCustomThemes() {
+        if (await this.loadThemeRegistry()) {
+            return;
+        }
         try {
             const response = await fetch('/core/css/themes/list');
             if (!response.ok) {
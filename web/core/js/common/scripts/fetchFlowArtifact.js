@@ -0,0 +1,35 @@
+import { fetchWorkflow } from './fetchWorkflow.js';
+import { fetchflowConfig } from './fetchflowConfig.js';
+
+function readInlineArtifact(flowName) {
+    const element = document.getElementById('flow-artifact');
+    if (!element || element.dataset.flow !== flowName) {
+        return null;
+    }
+    try {
+        return JSON.parse(element.textContent);
+    } catch (error) {
+        console.warn('Ignoring unreadable inline flow artifact:', error);
+        return null;
+    }
+}
+
+export async function fetchFlowArtifact(flowName) {
+    const inlineArtifact = readInlineArtifact(flowName);
+    if (inlineArtifact && inlineArtifact.workflow) {
+        return { flowConfig: inlineArtifact.config, workflow: inlineArtifact.workflow, artifact: inlineArtifact };
+    }
+    try {
+        const response = await fetch(`/flow/api/flow-artifact?url=${encodeURIComponent(flowName)}`);
+        if (!response.ok) {
+            throw new Error(`Failed to fetch artifact for flow '${flowName}'. HTTP status: ${response.status}`);
+        }
+        const artifact = await response.json();
+        return { flowConfig: artifact.config, workflow: artifact.workflow, artifact };
+    } catch (error) {
+        console.warn('Falling back to wf.json and flowConfig.json:', error);
+        const flowConfig = await fetchflowConfig(flowName);
+        const workflow = await fetchWorkflow(flowName);
+        return { flowConfig, workflow, artifact: null };
+    }
+}
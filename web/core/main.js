@@ -14,8 +14,7 @@ import { uuidv4, showSpinner, hideSpinner } from './js/common/components/utils.j
 import { initializeWebSocket } from './js/common/components/messageHandler.js';
 import { updateWorkflowValue } from './js/common/components/workflowManager.js';
 import { processWorkflowNodes } from './js/common/scripts/nodesscanner.js';
-import { fetchWorkflow } from './js/common/scripts/fetchWorkflow.js'; 
-import { fetchflowConfig } from './js/common/scripts/fetchflowConfig.js'; 
+import { fetchFlowArtifact } from './js/common/scripts/fetchFlowArtifact.js';
 import { setFaviconStatus } from './js/common/scripts/favicon.js'; 
 import { PreferencesManager } from './js/common/scripts/preferences.js';
 import { initialize } from './js/common/scripts/interactiveUI.js';
@@ -71,8 +70,8 @@ import { store } from  './js/common/scripts/stateManagerMain.js';
 
     const flowName = getFlowName();
     const client_id = uuidv4();
-    const flowConfig = await fetchflowConfig(flowName);
-    let workflow = await fetchWorkflow(flowName);
+    const { flowConfig, workflow: flowWorkflow } = await fetchFlowArtifact(flowName);
+    let workflow = flowWorkflow;
     let canvasLoader;
 
     const seeders = [];